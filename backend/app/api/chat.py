@@ -20,6 +20,10 @@ from app.utils.validators import InputValidator
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
+# IDs internados dos contadores do endpoint
+_CHAT_REQUESTS_TOTAL = metrics_collector.counter_id("chat.requests.total")
+_CHAT_SIMPLE_HIT = metrics_collector.counter_id("chat.cache.simple_hit")
+
 # Circuit breaker para Gemini API
 gemini_circuit_breaker = CircuitBreaker(
     failure_threshold=3,
@@ -183,7 +187,7 @@ def _check_simple_response(message: str) -> Optional[str]:
 
 @router.post("/chat", response_model=ChatResponse)
 async def chat(request: ChatRequest):
-    metrics_collector.increment_counter("chat.requests.total")
+    metrics_collector.inc_id(_CHAT_REQUESTS_TOTAL)
     
     try:
         with Timer(metrics_collector, "chat.request.duration"):
@@ -194,7 +198,7 @@ async def chat(request: ChatRequest):
             simple_response = _check_simple_response(request.message)
             if simple_response:
                 logger.info("Resposta simples encontrada no cache")
-                metrics_collector.increment_counter("chat.cache.simple_hit")
+                metrics_collector.inc_id(_CHAT_SIMPLE_HIT)
                 return ChatResponse(
                     response=simple_response,
                     conversation_id=conversation_id,
@@ -224,13 +228,19 @@ async def chat(request: ChatRequest):
             )
         
         search_results = []
+        try:
+            query_embedding = (await chroma_service.generate_embeddings_one(request.message)).tolist()
+        except Exception as e:
+            logger.error(f"Erro ao gerar embedding da consulta: {e}")
+            query_embedding = None
         if request.search_collections:
             for collection_name in request.search_collections:
                 try:
                     results = chroma_service.query_collection(
                         collection_name=collection_name,
                         query_text=request.message,
-                        n_results=request.max_results
+                        n_results=request.max_results,
+                        query_embedding=query_embedding
                     )
                     for i, doc in enumerate(results.get('documents', [[]])[0]):
                         search_results.append({
@@ -247,7 +257,8 @@ async def chat(request: ChatRequest):
                 results = chroma_service.search_across_collections_optimized(
                     query_text=request.message,
                     n_results=request.max_results,
-                    max_collections=None  # None = busca inteligente por palavras-chave
+                    max_collections=None,  # None = busca inteligente por palavras-chave
+                    query_embedding=query_embedding
                 )
                 # Garantir que results é um dicionário antes de acessar
                 if isinstance(results, dict):
@@ -345,7 +356,8 @@ def _prepare_context(search_results: List[Dict[str, Any]]) -> str:
             
             distance = result.get('distance')
             if distance is not None:
-                relevance = "Alta" if distance < 0.5 else "Media" if distance < 1.0 else "Baixa"
+                # Distância de cosseno (0 = idêntico, 1 = ortogonal)
+                relevance = "Alta" if distance < 0.25 else "Media" if distance < 0.5 else "Baixa"
                 context_parts.append(f"     Relevancia: {relevance} (score: {distance:.3f})")
 
     return "\n".join(context_parts)
@@ -18,6 +18,11 @@ class Settings(BaseSettings):
     
     chroma_persist_directory: str = str(BASE_DIR / "db_migration" / "chroma_db")
     embedding_model: str = "all-MiniLM-L6-v2"
+    embedding_dtype: str = "float32"  # float32, float16 ou bfloat16
+    embedding_compile: bool = False  # torch.compile no encoder (shapes dinâmicos)
+    embedding_max_seq_length: Optional[int] = None
+    # Caches derivados (ex.: centróides das collections), fora do diretório do ChromaDB
+    centroid_cache_dir: str = str(BASE_DIR / "backend" / ".cache")
     
     # Configurações Redis
     redis_host: str = "localhost"
@@ -1,11 +1,123 @@
 import chromadb
 from chromadb.config import Settings as ChromaSettings
 from sentence_transformers import SentenceTransformer
-from typing import List, Dict, Any, Optional
+import torch
+from typing import Callable, List, Dict, Any, Optional
+import numpy as np
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 import uuid
 import os
+import hashlib
+import logging
+import threading
+import time
 from app.config.settings import settings
 
+try:
+    import faiss
+    FAISS_AVAILABLE = True
+except ImportError:
+    FAISS_AVAILABLE = False
+    faiss = None
+
+logger = logging.getLogger(__name__)
+
+# Centróides por collection para ranquear collections antes da busca
+CENTROID_SAMPLE_SIZE = 256
+CENTROID_CACHE_PREFIX = "collection_centroids"
+# Intervalo (s) entre conferências das contagens quando o conjunto de nomes não muda
+CENTROID_FINGERPRINT_TTL = 60
+SCHEMA_SUMMARY_WORKERS = 16
+# Espaço padrão do HNSW no Chroma quando a collection não define "hnsw:space"
+DEFAULT_HNSW_SPACE = "l2"
+
+
+def _to_cosine_distance(distances: List[float], space: str) -> List[float]:
+    """
+    Converte distâncias do espaço da collection para distância de cosseno.
+    Com vetores normalizados: l2 (quadrada) = 2 - 2cos e ip = 1 - cos,
+    então resultados de collections antigas (l2) e novas (cosine) ficam comparáveis.
+    """
+    if space == "l2":
+        return [d / 2 if d is not None else None for d in distances]
+    return distances
+
+
+def _top_k_by_distance(results: List[Dict[str, Any]], k: int) -> List[Dict[str, Any]]:
+    """Seleciona os k resultados de menor distância (None conta como infinito)"""
+    if not results or k <= 0:
+        return []
+
+    distances = np.fromiter(
+        (r['distance'] if r['distance'] is not None else np.inf for r in results),
+        dtype=np.float32,
+        count=len(results)
+    )
+    if k < len(results):
+        top = np.argpartition(distances, k - 1)[:k]
+    else:
+        top = np.arange(len(results))
+    top = top[np.argsort(distances[top], kind='stable')]
+    return [results[i] for i in top]
+
+
+class EmbeddingBatcher:
+    """
+    Agrupa pedidos concorrentes de embedding em um único encode.
+    Pedidos que chegam dentro de `max_wait_ms` compartilham o mesmo forward pass.
+    """
+
+    def __init__(
+        self,
+        encode: Callable[[List[str]], np.ndarray],
+        max_batch_size: int = 32,
+        max_wait_ms: float = 5.0
+    ):
+        self._encode = encode
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    async def embed(self, text: str) -> np.ndarray:
+        loop = asyncio.get_running_loop()
+        if self._worker is None or self._worker.done() or self._worker.get_loop() is not loop:
+            self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._run())
+
+        future = loop.create_future()
+        self._queue.put_nowait((text, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            texts = [text for text, _ in batch]
+            try:
+                embeddings = await loop.run_in_executor(None, self._encode, texts)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for (_, future), embedding in zip(batch, embeddings):
+                if not future.done():
+                    future.set_result(embedding)
+
 
 class ChromaService:
 
@@ -14,9 +126,19 @@ class ChromaService:
         self.model_name = settings.embedding_model
         self._client = None
         self._embedding_model = None
+        # (nomes, matriz de centróides, índice FAISS ou None)
+        self._centroid_state: tuple = ([], None, None)
+        # Nomes vistos na última conferência, impressão digital (nomes + contagens) do índice
+        self._centroid_source_names: Optional[tuple] = None
+        self._centroid_fingerprint: Optional[str] = None
+        self._centroid_checked_at = 0.0
+        self._centroid_lock = threading.Lock()
+        self._batcher = EmbeddingBatcher(self._encode_batch)
 
     def reset_client(self):
         self._client = None
+        self._centroid_source_names = None
+        self._centroid_fingerprint = None
         self.persist_directory = settings.chroma_persist_directory
         self._initialize_client()
 
@@ -33,7 +155,33 @@ class ChromaService:
 
     def _initialize_embedding_model(self):
         if self._embedding_model is None:
-            self._embedding_model = SentenceTransformer(self.model_name)
+            model = SentenceTransformer(self.model_name)
+            if settings.embedding_max_seq_length:
+                model.max_seq_length = settings.embedding_max_seq_length
+            self._embedding_model = self._optimize_embedding_model(model)
+
+    def _optimize_embedding_model(self, model: SentenceTransformer) -> SentenceTransformer:
+        """
+        Aplica precisão reduzida e torch.compile conforme as configurações.
+        Os batches são preenchidos só até o maior texto, então o comprimento
+        varia a cada chamada: a compilação usa shapes dinâmicos (sem CUDA
+        graphs por shape) para não recompilar a cada novo comprimento. O
+        warmup roda um batch representativo antes do primeiro uso.
+        """
+        if settings.embedding_dtype != "float32":
+            model = model.to(getattr(torch, settings.embedding_dtype))
+
+        if settings.embedding_compile:
+            transformer = model._first_module()
+            eager_model = transformer.auto_model
+            try:
+                transformer.auto_model = torch.compile(eager_model, dynamic=True)
+                model.encode(["warmup"] * 32, batch_size=32)
+            except Exception as e:
+                logger.warning(f"torch.compile indisponível, usando modo eager: {e}")
+                transformer.auto_model = eager_model
+
+        return model
 
     @property
     def client(self):
@@ -46,9 +194,178 @@ class ChromaService:
         return self._embedding_model
 
     def generate_embeddings(self, texts: List[str], batch_size: int = 32) -> List[List[float]]:
-        embeddings = self.embedding_model.encode(texts, convert_to_numpy=True)
+        embeddings = self.embedding_model.encode(texts, convert_to_numpy=True, normalize_embeddings=True)
         return embeddings.tolist()
 
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        return self.embedding_model.encode(
+            texts, batch_size=32, convert_to_numpy=True, normalize_embeddings=True
+        )
+
+    async def generate_embeddings_one(self, text: str) -> np.ndarray:
+        """
+        Gera o embedding de um único texto via micro-batching.
+        Chamadas concorrentes são agrupadas em um só encode.
+        """
+        return await self._batcher.embed(text)
+
+    def _centroid_cache_path(self) -> str:
+        """
+        Arquivo de cache dos centróides, fora do diretório de dados do ChromaDB
+        (um arquivo por persist_directory).
+        """
+        key = hashlib.sha1(os.path.abspath(self.persist_directory).encode("utf-8")).hexdigest()[:12]
+        return os.path.join(settings.centroid_cache_dir, f"{CENTROID_CACHE_PREFIX}_{key}.npz")
+
+    def _collections_fingerprint(self, collection_names: tuple) -> str:
+        """Digest dos nomes (ordenados) e do count() de cada collection"""
+        h = hashlib.sha1()
+        for name in collection_names:
+            h.update(name.encode("utf-8"))
+            h.update(b"\0")
+            h.update(str(self.client.get_collection(name).count()).encode("ascii"))
+            h.update(b"\0")
+        return h.hexdigest()
+
+    def warm_centroid_index(self):
+        """Monta o índice de centróides antecipadamente (ex.: no startup, em thread)"""
+        try:
+            self._build_centroid_index()
+        except Exception as e:
+            logger.warning(f"Falha ao pré-carregar índice de centróides: {e}")
+
+    def _build_centroid_index(self, collection_names: Optional[List[str]] = None, wait: bool = True):
+        """
+        Carrega (ou calcula) o centróide normalizado de cada collection.
+
+        O índice (e o cache em disco) é chaveado por um digest dos nomes e do
+        count() de cada collection: muda o conjunto ou o conteúdo, o índice é
+        refeito. Com o mesmo conjunto de nomes, as contagens são conferidas no
+        máximo a cada CENTROID_FINGERPRINT_TTL segundos. Uma falha na montagem
+        fica registrada até o digest mudar, sem recalcular a cada busca.
+
+        Args:
+            collection_names: Nomes das collections, quando o chamador já os
+                tem (evita um list_collections por busca)
+            wait: Se False e outra thread já estiver montando o índice (ex.:
+                o warmup do startup), retorna na hora com o índice atual
+        """
+        if collection_names is None:
+            collection_names = [col.name for col in self.client.list_collections()]
+        source_names = tuple(sorted(collection_names))
+
+        if not self._centroid_lock.acquire(blocking=wait):
+            return
+        try:
+            now = time.monotonic()
+            if (
+                source_names == self._centroid_source_names
+                and now - self._centroid_checked_at < CENTROID_FINGERPRINT_TTL
+            ):
+                return
+
+            names, centroids, index, fingerprint = [], None, None, None
+            try:
+                fingerprint = self._collections_fingerprint(source_names)
+                if fingerprint == self._centroid_fingerprint:
+                    self._centroid_source_names = source_names
+                    self._centroid_checked_at = now
+                    return
+
+                names, centroids = self._load_or_compute_centroids(source_names, fingerprint)
+                if FAISS_AVAILABLE and len(names) > 0:
+                    index = faiss.IndexFlatIP(centroids.shape[1])
+                    index.add(centroids)
+            except Exception as e:
+                # Mantém o digest (se calculado): só tenta de novo quando ele mudar
+                logger.warning(f"Falha ao montar índice de centróides, ranqueamento desativado: {e}")
+                names, centroids, index = [], None, None
+
+            # Uma única atribuição: buscas concorrentes veem o estado antigo ou o novo
+            self._centroid_state = (names, centroids, index)
+            self._centroid_fingerprint = fingerprint
+            self._centroid_source_names = source_names
+            self._centroid_checked_at = now
+        finally:
+            self._centroid_lock.release()
+
+    def _load_or_compute_centroids(self, collection_names: tuple, fingerprint: str):
+        """Lê os centróides do cache em disco (mesmo digest) ou os calcula a partir de amostras"""
+        cache_path = self._centroid_cache_path()
+
+        if os.path.exists(cache_path):
+            try:
+                with np.load(cache_path, allow_pickle=False) as data:
+                    if 'fingerprint' in data.files and str(data['fingerprint']) == fingerprint:
+                        return data['names'].tolist(), data['centroids']
+            except Exception as e:
+                logger.warning(f"Cache de centróides inválido, recalculando: {e}")
+
+        names, vectors = [], []
+        for name in collection_names:
+            collection = self.client.get_collection(name)
+            sample = collection.get(include=["embeddings"], limit=CENTROID_SAMPLE_SIZE)
+            embeddings = sample.get('embeddings')
+            if embeddings is None or len(embeddings) == 0:
+                continue
+
+            centroid = np.asarray(embeddings, dtype=np.float32).mean(axis=0)
+            norm = np.linalg.norm(centroid)
+            if norm == 0:
+                continue
+
+            names.append(name)
+            vectors.append(centroid / norm)
+
+        centroids = np.stack(vectors).astype(np.float32) if vectors else np.empty((0, 0), dtype=np.float32)
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        np.savez(cache_path, names=np.array(names), centroids=centroids, fingerprint=np.array(fingerprint))
+        return names, centroids
+
+    def rank_collections_by_centroid(
+        self,
+        query_embedding: List[float],
+        k: int,
+        collection_names: Optional[List[str]] = None
+    ) -> List[str]:
+        """
+        Retorna as k collections cujo centróide tem maior similaridade com a query.
+
+        Args:
+            query_embedding: Embedding da consulta
+            k: Número de collections a retornar
+            collection_names: Lista de collections já obtida pelo chamador
+
+        Returns:
+            Nomes das collections ordenados por relevância
+        """
+        # Não bloqueia a busca enquanto outra thread monta o índice
+        self._build_centroid_index(collection_names, wait=False)
+        centroid_names, centroid_matrix, centroid_index = self._centroid_state
+        if not centroid_names or k <= 0:
+            return []
+
+        query_vec = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(query_vec)
+        if norm > 0:
+            query_vec = query_vec / norm
+        k = min(k, len(centroid_names))
+
+        if centroid_index is not None:
+            _, indices = centroid_index.search(query_vec[None, :], k)
+            top = indices[0]
+        else:
+            scores = centroid_matrix @ query_vec
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+
+        # Nunca devolve collections que o chamador não conhece (ex.: removidas)
+        allowed = set(collection_names) if collection_names is not None else None
+        return [
+            centroid_names[i] for i in top
+            if i >= 0 and (allowed is None or centroid_names[i] in allowed)
+        ]
+
     def list_collections(self) -> List[Dict[str, Any]]:
         """
         Lista todas as collections disponíveis no ChromaDB.
@@ -106,7 +423,8 @@ class ChromaService:
                 results = self.query_collection(
                     collection_name=collection_name,
                     query_text=query_text,
-                    n_results=n_results
+                    n_results=n_results,
+                    query_embedding=query_embedding
                 )
 
                 # Adiciona o nome da collection aos resultados
@@ -122,21 +440,20 @@ class ChromaService:
                 print(f"Erro ao buscar na collection {collection_name}: {e}")
                 continue
 
-        # Ordena por distância (menor distância = mais similar)
-        all_results.sort(key=lambda x: x.get('distance', float('inf')))
-
         return {
             'query': query_text,
             'total_collections_searched': len(collection_names),
             'total_results': len(all_results),
-            'results': all_results[:n_results * 2]  # Retorna mais resultados agregados
+            # Menor distância = mais similar; retorna mais resultados agregados
+            'results': _top_k_by_distance(all_results, n_results * 2)
         }
 
     def query_collection(
         self,
         collection_name: str,
         query_text: str,
-        n_results: int = 5
+        n_results: int = 5,
+        query_embedding: Optional[List[float]] = None
     ) -> Dict[str, Any]:
         """
         Consulta uma collection específica.
@@ -145,18 +462,25 @@ class ChromaService:
             collection_name: Nome da collection
             query_text: Texto da consulta
             n_results: Número de resultados a retornar
+            query_embedding: Embedding já calculado da consulta (opcional)
 
         Returns:
-            Resultados da busca
+            Resultados da busca, com distâncias em espaço de cosseno
         """
         collection = self.client.get_collection(collection_name)
-        query_embedding = self.generate_embeddings([query_text])[0]
+        if query_embedding is None:
+            query_embedding = self.generate_embeddings([query_text])[0]
 
         results = collection.query(
             query_embeddings=[query_embedding],
             n_results=n_results
         )
 
+        # Normaliza as distâncias antes de serem mescladas com outras collections
+        space = (collection.metadata or {}).get("hnsw:space", DEFAULT_HNSW_SPACE)
+        if results.get('distances'):
+            results['distances'] = [_to_cosine_distance(row, space) for row in results['distances']]
+
         return results
 
     def get_database_schema_summary(self) -> Dict[str, Any]:
@@ -176,20 +500,20 @@ class ChromaService:
         # OTIMIZAÇÃO: Mostra apenas as primeiras 50 collections com info básica
         # Para 5000+ collections, é impraticável contar documentos de todas
         max_detailed = 50
-        
-        for i, col_info in enumerate(collections):
-            col_name = col_info['name']
-            if i < max_detailed:
-                # Informações detalhadas apenas para as primeiras
-                info = self.get_collection_info(col_name)
-                summary['collections'].append(info)
-            else:
-                # Para o resto, apenas nome (sem contar documentos)
-                summary['collections'].append({
-                    "name": col_name,
-                    "count": "não calculado (otimização)",
-                    "metadata": {}
-                })
+        names = [col_info['name'] for col_info in collections]
+        detailed_names = names[:max_detailed]
+
+        # Cada count() é uma chamada independente de I/O: consulta em paralelo
+        if detailed_names:
+            workers = min(SCHEMA_SUMMARY_WORKERS, len(detailed_names))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                summary['collections'] = list(executor.map(self.get_collection_info, detailed_names))
+
+        # Para o resto, apenas nome (sem contar documentos)
+        summary['collections'].extend(
+            {"name": col_name, "count": "não calculado (otimização)", "metadata": {}}
+            for col_name in names[max_detailed:]
+        )
 
         return summary
 
@@ -226,11 +550,28 @@ class ChromaService:
             'note': 'Estatísticas estimadas para performance otimizada'
         }
 
+    def _select_collections(
+        self,
+        query_embedding: List[float],
+        collections: List[Dict[str, Any]],
+        limit: int
+    ) -> List[str]:
+        """Seleciona até `limit` collections ranqueadas por centróide (ou as primeiras, se indisponível)"""
+        try:
+            ranked = self.rank_collections_by_centroid(
+                query_embedding, limit, [col['name'] for col in collections]
+            )
+        except Exception as e:
+            logger.warning(f"Falha ao ranquear collections por centróide: {e}")
+            ranked = []
+        return ranked or [col['name'] for col in collections[:limit]]
+
     def search_across_collections_optimized(
         self,
         query_text: str,
         n_results: int = 3,
-        max_collections: Optional[int] = 50
+        max_collections: Optional[int] = 50,
+        query_embedding: Optional[List[float]] = None
     ) -> Dict[str, Any]:
         """
         Busca OTIMIZADA em collections.
@@ -238,6 +579,9 @@ class ChromaService:
         """
         all_results = []
         all_collections_list = self.list_collections()
+
+        if query_embedding is None:
+            query_embedding = self.generate_embeddings([query_text])[0]
         
         # OTIMIZAÇÃO INTELIGENTE: Se max_collections é None, busca por relevância
         if max_collections is None:
@@ -251,26 +595,23 @@ class ChromaService:
                 col_name_lower = col['name'].lower()
                 # Verifica se alguma keyword aparece no nome da collection
                 if any(keyword in col_name_lower for keyword in keywords):
-                    relevant_collections.append(col)
+                    relevant_collections.append(col['name'])
             
-            # Se encontrou collections relevantes, usa elas. Senão, usa as primeiras 100
+            # Se encontrou collections relevantes, usa elas. Senão, ranqueia por centróide
             if relevant_collections:
-                collections = relevant_collections[:100]  # Limita a 100 para segurança
+                collection_names = relevant_collections[:100]  # Limita a 100 para segurança
             else:
-                collections = all_collections_list[:100]  # Fallback: primeiras 100
+                collection_names = self._select_collections(query_embedding, all_collections_list, 100)
         else:
-            collections = all_collections_list[:max_collections]
-        
-        collection_names = [col['name'] for col in collections]
-        
-        query_embedding = self.generate_embeddings([query_text])[0]
+            collection_names = self._select_collections(query_embedding, all_collections_list, max_collections)
 
         for collection_name in collection_names:
             try:
                 results = self.query_collection(
                     collection_name=collection_name,
                     query_text=query_text,
-                    n_results=1  # Apenas 1 resultado por collection
+                    n_results=1,  # Apenas 1 resultado por collection
+                    query_embedding=query_embedding
                 )
 
                 # Adiciona resultado se relevante
@@ -284,9 +625,6 @@ class ChromaService:
             except Exception:
                 continue  # Ignora erros silenciosamente para performance
 
-        # Ordena por relevância e retorna os melhores resultados
-        all_results.sort(key=lambda x: x.get('distance', float('inf')))
-        
         # Retorna mais resultados se a busca for em todas as collections
         results_limit = n_results * 3 if max_collections is None else n_results
 
@@ -295,7 +633,7 @@ class ChromaService:
             'collections_searched': len(collection_names),
             'total_collections_available': len(all_collections_list),
             'total_results': len(all_results),
-            'results': all_results[:results_limit],
+            'results': _top_k_by_distance(all_results, results_limit),
             'optimization': 'Busca em TODAS as collections' if max_collections is None else f'Busca limitada a {max_collections} collections'
         }
 
@@ -1,9 +1,16 @@
 import logging
-from typing import Dict, List, Any, Optional
-from hashlib import md5
+from typing import Dict, List, Any, Optional, Tuple
+from hashlib import blake2b
 import time
 from app.utils.logger import log_info, log_debug, log_warning
 
+try:
+    import xxhash
+    XXHASH_AVAILABLE = True
+except ImportError:
+    XXHASH_AVAILABLE = False
+    xxhash = None
+
 logger = logging.getLogger(__name__)
 
 
@@ -11,57 +18,71 @@ class ToonsOptimizer:
     def __init__(self, max_cache_size: int = 100, compression_ratio: float = 0.7):
         self.max_cache_size = max_cache_size
         self.compression_ratio = compression_ratio
-        self._cache: Dict[str, Dict[str, Any]] = {}
+        self._cache: Dict[int, Dict[str, Any]] = {}
         self._cache_hits = 0
         self._cache_misses = 0
         self._total_tokens_saved = 0
         log_info(f"TOONS inicializado: cache={max_cache_size}, ratio={compression_ratio}", emoji='rocket', module='TOONS')
 
-    def _hash_content(self, content: str) -> str:
-        return md5(content.encode()).hexdigest()
+    def _normalize_lines(self, context: str, max_length: int) -> Tuple[List[str], int]:
+        """
+        Remove linhas vazias/duplicadas e calcula, na mesma passada, o digest
+        usado como chave do cache. Contextos que diferem apenas em espaços,
+        linhas em branco ou repetições compartilham a mesma entrada.
+        """
+        digest = xxhash.xxh3_128() if XXHASH_AVAILABLE else blake2b(digest_size=16)
+        seen = set()
+        lines = []
+        
+        for line in context.split('\n'):
+            stripped = line.strip()
+            if stripped and stripped not in seen:
+                seen.add(stripped)
+                lines.append(stripped)
+                digest.update(stripped.encode())
+                digest.update(b'\n')
+        
+        digest.update(str(max_length).encode())
+        key = digest.intdigest() if XXHASH_AVAILABLE else int.from_bytes(digest.digest(), 'big')
+        return lines, key
 
     def compress_context(self, context: str, max_length: int = 1000) -> Dict[str, Any]:
         start_time = time.time()
         original_length = len(context)
-        content_hash = self._hash_content(context)
+        lines, content_hash = self._normalize_lines(context, max_length)
         
-        if content_hash in self._cache:
-            cached = self._cache[content_hash]
+        cached = self._cache.get(content_hash)
+        if cached is not None:
             self._cache_hits += 1
-            elapsed = time.time() - start_time
-            logger.debug(f"Cache HIT: {content_hash[:8]}...")
-            return {
-                "compressed": cached['compressed'],
-                "original_length": original_length,
-                "compressed_length": len(cached['compressed']),
-                "reduction_percentage": round((1 - len(cached['compressed']) / original_length) * 100, 1),
-                "from_cache": True,
-                "processing_time_ms": round(elapsed * 1000, 2),
-                "tokens_saved_estimate": int(original_length * (1 - self.compression_ratio) / 4)
-            }
+            logger.debug(f"Cache HIT: {content_hash:032x}")
+            response = cached.copy()
+            del response['timestamp']
+            # A chave normalizada pode casar com um original de tamanho diferente
+            if original_length != cached['original_length']:
+                response.update(self._length_fields(cached['compressed_length'], original_length))
+            response['from_cache'] = True
+            response['processing_time_ms'] = round((time.time() - start_time) * 1000, 2)
+            return response
         
         self._cache_misses += 1
-        compressed = self._apply_compression_techniques(context, max_length)
-        compressed_length = len(compressed)
-        self._store_in_cache(content_hash, compressed)
-        
-        elapsed = time.time() - start_time
-        tokens_saved = int(original_length * (1 - self.compression_ratio) / 4)
-        self._total_tokens_saved += tokens_saved
+        compressed = self._apply_compression_techniques(lines, max_length)
+        entry = self._store_in_cache(content_hash, compressed, original_length)
+        self._total_tokens_saved += entry['tokens_saved_estimate']
         
+        response = entry.copy()
+        del response['timestamp']
+        response['from_cache'] = False
+        response['processing_time_ms'] = round((time.time() - start_time) * 1000, 2)
+        return response
+
+    def _length_fields(self, compressed_length: int, original_length: int) -> Dict[str, Any]:
         return {
-            "compressed": compressed,
             "original_length": original_length,
-            "compressed_length": compressed_length,
             "reduction_percentage": round((1 - compressed_length / original_length) * 100, 1),
-            "from_cache": False,
-            "processing_time_ms": round(elapsed * 1000, 2),
-            "tokens_saved_estimate": tokens_saved
+            "tokens_saved_estimate": int(original_length * (1 - self.compression_ratio) / 4)
         }
 
-    def _apply_compression_techniques(self, context: str, max_length: int) -> str:
-        lines = [line.strip() for line in context.split('\n') if line.strip()]
-        lines = list(dict.fromkeys(lines))
+    def _apply_compression_techniques(self, lines: List[str], max_length: int) -> str:
         compressed = '\n'.join(lines)
         
         if len(compressed) > max_length:
@@ -70,12 +91,21 @@ class ToonsOptimizer:
         
         return compressed
 
-    def _store_in_cache(self, content_hash: str, compressed_content: str):
+    def _store_in_cache(self, content_hash: int, compressed_content: str, original_length: int) -> Dict[str, Any]:
         if len(self._cache) >= self.max_cache_size:
             oldest_key = next(iter(self._cache))
             del self._cache[oldest_key]
         
-        self._cache[content_hash] = {'compressed': compressed_content, 'timestamp': time.time()}
+        # Guarda a resposta pronta para que um HIT seja apenas uma cópia do dict
+        compressed_length = len(compressed_content)
+        entry = {
+            "compressed": compressed_content,
+            "compressed_length": compressed_length,
+            **self._length_fields(compressed_length, original_length),
+            "timestamp": time.time()
+        }
+        self._cache[content_hash] = entry
+        return entry
 
     def optimize_prompt(self, system_prompt: str, context: str, user_message: str) -> Dict[str, Any]:
         compression_result = self.compress_context(context)
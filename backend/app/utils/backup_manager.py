@@ -4,20 +4,46 @@ Cria backups comprimidos com timestamp e gerencia rotação de backups antigos.
 """
 
 import os
+import re
+import bz2
+import gzip
+import json
+import lzma
 import shutil
+import sqlite3
+import tempfile
+import hashlib
 import tarfile
 import logging
 from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Optional
+from typing import Dict, Optional
 import argparse
 
+try:
+    from fastcdc import fastcdc
+    FASTCDC_AVAILABLE = True
+except ImportError:
+    FASTCDC_AVAILABLE = False
+    fastcdc = None
+
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
 
+# Arquivos temporários excluídos do backup (uma única varredura por nome)
+EXCLUDE_PATTERN = re.compile(r"(?:\.tmp$|\.temp$|__pycache__|\.pyc$)")
+
+# Backups incrementais: chunks de ~4 MB endereçados por SHA-256
+CHUNK_AVG_SIZE = 4 * 1024 * 1024
+CHUNK_CODECS = {"gz": gzip, "bz2": bz2, "xz": lzma}
+
+# Bancos SQLite do ChromaDB são copiados via VACUUM INTO (sem páginas livres)
+SQLITE_PATTERN = "*.sqlite3"
+SQLITE_SIDECAR_SUFFIXES = ("-wal", "-shm", "-journal")
+
 
 class ChromaDBBackup:
     """Gerenciador de backups do ChromaDB"""
@@ -79,12 +105,29 @@ class ChromaDBBackup:
         
         try:
             # Cria arquivo tar comprimido
-            with tarfile.open(backup_file, f"w:{self.compression}") as tar:
+            with tempfile.TemporaryDirectory(dir=self.backup_dir) as tmp_dir, \
+                    tarfile.open(backup_file, f"w:{self.compression}") as tar:
+                snapshots = self._snapshot_sqlite(Path(tmp_dir))
+                
+                # Os originais (e seus arquivos -wal/-shm) são substituídos pelos snapshots
+                skipped = {
+                    arcname + suffix
+                    for arcname in snapshots
+                    for suffix in ("",) + SQLITE_SIDECAR_SUFFIXES
+                }
+                
+                def tar_filter(tarinfo):
+                    if tarinfo.name in skipped:
+                        return None
+                    return self._tar_filter(tarinfo)
+                
                 tar.add(
                     self.chroma_db_path,
                     arcname=self.chroma_db_path.name,
-                    filter=self._tar_filter
+                    filter=tar_filter
                 )
+                for arcname, snapshot in snapshots.items():
+                    tar.add(snapshot, arcname=arcname)
             
             # Obtém tamanho do backup
             backup_size = backup_file.stat().st_size
@@ -102,6 +145,182 @@ class ChromaDBBackup:
                 backup_file.unlink()
             raise
     
+    def create_incremental_backup(self, description: Optional[str] = None) -> Path:
+        """
+        Cria um backup incremental do ChromaDB.
+        
+        Cada arquivo é dividido em chunks (content-defined via FastCDC quando
+        disponível, tamanho fixo caso contrário) salvos em `chunks/<codec>/`
+        pelo hash SHA-256. Apenas chunks ainda não armazenados são comprimidos e gravados;
+        o manifesto JSON mapeia cada arquivo para sua lista de chunks.
+        
+        Args:
+            description: Descrição opcional do backup
+            
+        Returns:
+            Caminho do manifesto criado
+        """
+        if not self.chroma_db_path.exists():
+            raise FileNotFoundError(f"ChromaDB não encontrado em {self.chroma_db_path}")
+        
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        backup_name = f"chromadb_incremental_{timestamp}"
+        
+        if description:
+            safe_desc = "".join(c for c in description if c.isalnum() or c in (' ', '-', '_')).strip()
+            safe_desc = safe_desc.replace(' ', '_')[:50]
+            backup_name = f"{backup_name}_{safe_desc}"
+        
+        manifest_file = self.backup_dir / f"{backup_name}.json"
+        self.chunks_dir.mkdir(parents=True, exist_ok=True)
+        
+        logger.info(f"Criando backup incremental: {manifest_file.name}")
+        
+        files = {}
+        new_chunks = 0
+        new_bytes = 0
+        
+        with tempfile.TemporaryDirectory(dir=self.backup_dir) as tmp_dir:
+            # Bancos SQLite entram pelo snapshot consistente (VACUUM INTO), sob o
+            # nome original; os arquivos -wal/-shm do banco vivo ficam de fora
+            prefix = f"{self.chroma_db_path.name}/"
+            snapshots = {
+                arcname[len(prefix):]: snapshot
+                for arcname, snapshot in self._snapshot_sqlite(Path(tmp_dir)).items()
+            }
+            sidecars = {
+                relative + suffix
+                for relative in snapshots
+                for suffix in SQLITE_SIDECAR_SUFFIXES
+            }
+            
+            for file_path in sorted(self.chroma_db_path.rglob("*")):
+                if not file_path.is_file():
+                    continue
+                
+                relative = file_path.relative_to(self.chroma_db_path).as_posix()
+                if EXCLUDE_PATTERN.search(relative) or relative in sidecars:
+                    continue
+                
+                hashes = []
+                for data in self._iter_chunks(snapshots.get(relative, file_path)):
+                    digest = hashlib.sha256(data).hexdigest()
+                    hashes.append(digest)
+                    
+                    if self._store_chunk(digest, data):
+                        new_chunks += 1
+                        new_bytes += len(data)
+                
+                files[relative] = hashes
+        
+        manifest = {
+            "type": "incremental",
+            "created_at": datetime.now().isoformat(),
+            "description": description,
+            "source": self.chroma_db_path.name,
+            "compression": self.compression,
+            "chunking": "fastcdc" if FASTCDC_AVAILABLE else "fixed",
+            "files": files
+        }
+        
+        tmp_manifest = manifest_file.with_suffix(".json.tmp")
+        with open(tmp_manifest, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        tmp_manifest.replace(manifest_file)
+        
+        logger.info(f"✓ Backup incremental criado: {manifest_file.name}")
+        logger.info(f"  Arquivos: {len(files)} | Chunks novos: {new_chunks} "
+                    f"({new_bytes / (1024 * 1024):.2f} MB)")
+        
+        return manifest_file
+    
+    @property
+    def chunks_dir(self) -> Path:
+        """Diretório dos chunks compartilhados pelos backups incrementais"""
+        return self.backup_dir / "chunks"
+    
+    def _iter_chunks(self, file_path: Path):
+        """Divide um arquivo em chunks (FastCDC ou tamanho fixo)"""
+        if FASTCDC_AVAILABLE:
+            for chunk in fastcdc(str(file_path), avg_size=CHUNK_AVG_SIZE, fat=True):
+                yield chunk.data
+            return
+        
+        with open(file_path, "rb") as f:
+            while True:
+                data = f.read(CHUNK_AVG_SIZE)
+                if not data:
+                    break
+                yield data
+    
+    def _chunk_path(self, compression: str, digest: str) -> Path:
+        """
+        Caminho do chunk: o codec faz parte do endereço, então backups com
+        compressões diferentes nunca reaproveitam o blob um do outro.
+        """
+        return self.chunks_dir / compression / digest
+    
+    def _store_chunk(self, digest: str, data: bytes) -> bool:
+        """Grava o chunk comprimido se ainda não existir. Retorna True se gravou."""
+        chunk_file = self._chunk_path(self.compression, digest)
+        if chunk_file.exists():
+            return False
+        
+        codec = CHUNK_CODECS[self.compression]
+        chunk_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = chunk_file.with_suffix(".tmp")
+        tmp_file.write_bytes(codec.compress(data))
+        tmp_file.replace(chunk_file)
+        return True
+    
+    def _restore_incremental(self, manifest_file: Path, target: Path):
+        """Remonta os arquivos de um manifesto incremental em target"""
+        with open(manifest_file, encoding="utf-8") as f:
+            manifest = json.load(f)
+        
+        compression = manifest.get("compression", "gz")
+        codec = CHUNK_CODECS[compression]
+        
+        for relative, hashes in manifest["files"].items():
+            file_path = target / relative
+            file_path.parent.mkdir(parents=True, exist_ok=True)
+            
+            with open(file_path, "wb") as out:
+                for digest in hashes:
+                    chunk_file = self._chunk_path(compression, digest)
+                    if not chunk_file.exists():
+                        # Manifestos antigos: chunks direto em chunks/<sha>
+                        chunk_file = self.chunks_dir / digest
+                    out.write(codec.decompress(chunk_file.read_bytes()))
+    
+    def _prune_chunks(self) -> int:
+        """Remove chunks não referenciados por nenhum manifesto"""
+        if not self.chunks_dir.exists():
+            return 0
+        
+        # Caminhos relativos a chunks/ ("<codec>/<sha>"; "<sha>" no formato antigo)
+        referenced = set()
+        for manifest_file in self.backup_dir.glob("chromadb_incremental_*.json"):
+            with open(manifest_file, encoding="utf-8") as f:
+                manifest = json.load(f)
+            compression = manifest.get("compression", "gz")
+            for hashes in manifest["files"].values():
+                for digest in hashes:
+                    referenced.add(f"{compression}/{digest}")
+                    referenced.add(digest)
+        
+        removed = 0
+        for chunk_file in self.chunks_dir.rglob("*"):
+            if not chunk_file.is_file():
+                continue
+            if chunk_file.relative_to(self.chunks_dir).as_posix() not in referenced:
+                chunk_file.unlink()
+                removed += 1
+        
+        if removed:
+            logger.info(f"✓ {removed} chunk(s) órfão(s) removido(s)")
+        return removed
+    
     def restore_backup(self, backup_file: Path, target_path: Optional[Path] = None) -> Path:
         """
         Restaura um backup.
@@ -133,9 +352,13 @@ class ChromaDBBackup:
             shutil.rmtree(target)
         
         try:
-            # Extrai backup
-            with tarfile.open(backup_file, f"r:{self.compression}") as tar:
-                tar.extractall(target.parent)
+            if backup_file.suffix == ".json":
+                # Backup incremental: remonta a partir dos chunks
+                self._restore_incremental(backup_file, target)
+            else:
+                # Extrai backup
+                with tarfile.open(backup_file, f"r:{self.compression}") as tar:
+                    tar.extractall(target.parent)
             
             logger.info(f"✓ Backup restaurado com sucesso em {target}")
             return target
@@ -152,17 +375,23 @@ class ChromaDBBackup:
             Lista de dicionários com informações dos backups
         """
         backups = []
+        backup_files = [
+            *self.backup_dir.glob("chromadb_backup_*.tar.*"),
+            *self.backup_dir.glob("chromadb_incremental_*.json")
+        ]
         
-        for backup_file in sorted(self.backup_dir.glob("chromadb_backup_*.tar.*"), reverse=True):
+        for backup_file in backup_files:
             stat = backup_file.stat()
             backups.append({
                 "filename": backup_file.name,
                 "path": str(backup_file),
+                "type": "incremental" if backup_file.suffix == ".json" else "full",
                 "size_mb": stat.st_size / (1024 * 1024),
                 "created_at": datetime.fromtimestamp(stat.st_mtime),
                 "age_days": (datetime.now() - datetime.fromtimestamp(stat.st_mtime)).days
             })
         
+        backups.sort(key=lambda b: b["created_at"], reverse=True)
         return backups
     
     def cleanup_old_backups(self) -> int:
@@ -187,14 +416,50 @@ class ChromaDBBackup:
             backup_path.unlink()
             removed_count += 1
         
+        if any(b["type"] == "incremental" for b in to_remove):
+            self._prune_chunks()
+        
         logger.info(f"✓ {removed_count} backup(s) antigo(s) removido(s)")
         return removed_count
     
+    def _snapshot_sqlite(self, tmp_dir: Path) -> Dict[str, Path]:
+        """
+        Gera cópias consistentes dos bancos SQLite via `VACUUM INTO`.
+        
+        O SQLite grava apenas as páginas em uso, então o snapshot é menor que
+        o arquivo original e não precisa passar páginas vazias pelo compressor.
+        
+        Returns:
+            Mapa arcname -> caminho do snapshot; bancos que falharem ficam de
+            fora e são copiados normalmente pelo tar.
+        """
+        snapshots = {}
+        
+        for i, db_file in enumerate(sorted(self.chroma_db_path.rglob(SQLITE_PATTERN))):
+            arcname = (Path(self.chroma_db_path.name) / db_file.relative_to(self.chroma_db_path)).as_posix()
+            target = tmp_dir / f"{i}_{db_file.name}"
+            
+            try:
+                conn = sqlite3.connect(db_file)
+                try:
+                    conn.execute("VACUUM INTO ?", (str(target),))
+                finally:
+                    conn.close()
+            except sqlite3.Error as e:
+                logger.warning(f"VACUUM INTO falhou para {db_file.name}, copiando arquivo bruto: {e}")
+                continue
+            
+            logger.info(
+                f"  Snapshot SQLite: {arcname} "
+                f"({db_file.stat().st_size / (1024 * 1024):.2f} MB -> {target.stat().st_size / (1024 * 1024):.2f} MB)"
+            )
+            snapshots[arcname] = target
+        
+        return snapshots
+    
     def _tar_filter(self, tarinfo):
         """Filtro para excluir arquivos temporários do backup"""
-        exclude_patterns = ['.tmp', '.temp', '__pycache__', '.pyc']
-        
-        if any(pattern in tarinfo.name for pattern in exclude_patterns):
+        if EXCLUDE_PATTERN.search(tarinfo.name):
             return None
         
         return tarinfo
@@ -220,7 +485,7 @@ def main():
     parser = argparse.ArgumentParser(description="Gerenciador de backups ChromaDB")
     parser.add_argument(
         "action",
-        choices=["create", "list", "cleanup", "restore", "stats"],
+        choices=["create", "incremental", "list", "cleanup", "restore", "stats"],
         help="Ação a executar"
     )
     parser.add_argument(
@@ -263,11 +528,16 @@ def main():
             backup_manager.cleanup_old_backups()
             print(f"\n✓ Backup criado: {backup_file}")
         
+        elif args.action == "incremental":
+            manifest_file = backup_manager.create_incremental_backup(description=args.description)
+            backup_manager.cleanup_old_backups()
+            print(f"\n✓ Backup incremental criado: {manifest_file}")
+        
         elif args.action == "list":
             backups = backup_manager.list_backups()
             print(f"\n📦 Backups disponíveis ({len(backups)}):\n")
             for i, backup in enumerate(backups, 1):
-                print(f"{i}. {backup['filename']}")
+                print(f"{i}. {backup['filename']} ({backup['type']})")
                 print(f"   Tamanho: {backup['size_mb']:.2f} MB")
                 print(f"   Criado: {backup['created_at'].strftime('%Y-%m-%d %H:%M:%S')}")
                 print(f"   Idade: {backup['age_days']} dias\n")
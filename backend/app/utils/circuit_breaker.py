@@ -5,12 +5,46 @@ Previne sobrecarga quando o serviço externo está falhando.
 
 import time
 import logging
+import threading
 from enum import Enum
-from typing import Callable, Any, Optional
-from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Any, Optional
+from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
+# Resolução do relógio grosso atualizado pela thread de fundo
+COARSE_CLOCK_RESOLUTION = 0.01
+
+_coarse_now = time.monotonic()
+_coarse_thread: Optional[threading.Thread] = None
+_coarse_lock = threading.Lock()
+
+
+def _coarse_ticker():
+    global _coarse_now
+    while True:
+        _coarse_now = time.monotonic()
+        time.sleep(COARSE_CLOCK_RESOLUTION)
+
+
+def coarse_monotonic() -> float:
+    """
+    Relógio monotônico com resolução de ~10 ms.
+    
+    Uma thread daemon atualiza o valor em segundo plano; a leitura é apenas
+    o acesso a uma variável global. Adequado como `now_func` do
+    CircuitBreaker, cujos timeouts são da ordem de segundos.
+    """
+    global _coarse_thread
+    if _coarse_thread is None:
+        with _coarse_lock:
+            if _coarse_thread is None:
+                _coarse_thread = threading.Thread(
+                    target=_coarse_ticker, name="coarse-monotonic", daemon=True
+                )
+                _coarse_thread.start()
+    return _coarse_now
+
 
 class CircuitState(Enum):
     """Estados do Circuit Breaker"""
@@ -39,7 +73,11 @@ class CircuitBreaker:
         failure_threshold: int = 5,
         recovery_timeout: int = 60,
         expected_exception: type = Exception,
-        name: str = "CircuitBreaker"
+        name: str = "CircuitBreaker",
+        half_open_max_probes: int = 1,
+        success_threshold: int = 3,
+        error_class: type = CircuitBreakerError,
+        now_func: Callable[[], float] = time.monotonic
     ):
         """
         Args:
@@ -47,16 +85,32 @@ class CircuitBreaker:
             recovery_timeout: Tempo (segundos) antes de tentar recuperar
             expected_exception: Tipo de exceção que conta como falha
             name: Nome do circuit breaker para logs
+            half_open_max_probes: Requisições simultâneas permitidas em HALF_OPEN
+            success_threshold: Sucessos consecutivos em HALF_OPEN para fechar o circuito
+            error_class: Exceção lançada quando a chamada é rejeitada
+            now_func: Relógio monotônico em segundos (ex.: coarse_monotonic ou mock em testes)
         """
         self.failure_threshold = failure_threshold
         self.recovery_timeout = recovery_timeout
         self.expected_exception = expected_exception
         self.name = name
+        self.half_open_max_probes = half_open_max_probes
+        self.success_threshold = success_threshold
+        self.error_class = error_class
+        self._now = now_func
         
         self.failure_count = 0
         self.success_count = 0
-        self.last_failure_time: Optional[datetime] = None
+        # Relógio monotônico para os cálculos; wall clock apenas para get_stats()
+        self.last_failure_time_mono: Optional[float] = None
+        self.last_failure_wall: Optional[datetime] = None
+        # ISO de last_failure_wall, gerado sob demanda em get_stats()
+        self._last_failure_iso: Optional[str] = None
         self.state = CircuitState.CLOSED
+        self._half_open_inflight = 0
+        self._half_open_successes = 0
+        # Protege apenas as transições de estado; a chamada protegida roda fora do lock
+        self._lock = threading.Lock()
         
         logger.info(f"Circuit Breaker '{name}' inicializado: "
                    f"threshold={failure_threshold}, timeout={recovery_timeout}s")
@@ -76,81 +130,214 @@ class CircuitBreaker:
             CircuitBreakerError: Se o circuito estiver aberto
             Exception: Exceção original da função
         """
-        if self.state == CircuitState.OPEN:
-            if self._should_attempt_reset():
-                logger.info(f"[{self.name}] Tentando recuperação (HALF_OPEN)")
-                self.state = CircuitState.HALF_OPEN
-            else:
+        probe = self._before_call()
+        
+        try:
+            result = func(*args, **kwargs)
+        except self.expected_exception:
+            self._on_failure(probe)
+            raise
+        except BaseException:
+            if probe:
+                self._release_probe()
+            raise
+        
+        self._on_success(probe)
+        return result
+    
+    async def acall(self, func: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        """
+        Versão assíncrona de `call`: aguarda a coroutine sem bloquear o event loop.
+        
+        O lock de estado é mantido apenas durante as transições (nunca
+        através de um await), então pode ser compartilhado com `call`.
+        
+        Args:
+            func: Função assíncrona a ser executada
+            *args, **kwargs: Argumentos da função
+            
+        Returns:
+            Resultado da coroutine
+            
+        Raises:
+            CircuitBreakerError: Se o circuito estiver aberto
+            Exception: Exceção original da função
+        """
+        probe = self._before_call()
+        
+        try:
+            result = await func(*args, **kwargs)
+        except self.expected_exception:
+            self._on_failure(probe)
+            raise
+        except BaseException:
+            # Inclui asyncio.CancelledError: libera a vaga de teste
+            if probe:
+                self._release_probe()
+            raise
+        
+        self._on_success(probe)
+        return result
+    
+    def _before_call(self) -> bool:
+        """
+        Verifica se a chamada pode prosseguir.
+        
+        Returns:
+            True se a chamada ocupa uma vaga de teste em HALF_OPEN
+            
+        Raises:
+            CircuitBreakerError: Se o circuito estiver aberto ou o teste em andamento
+        """
+        probe = False
+        if self.state != CircuitState.CLOSED:
+            probe = self.try_acquire_half_open()
+            state = self.state
+            
+            if not probe and state == CircuitState.HALF_OPEN:
+                logger.warning(f"[{self.name}] Circuit HALF_OPEN - teste de recuperação em andamento")
+                raise self.error_class(
+                    f"Circuit breaker '{self.name}' está testando a recuperação. "
+                    f"Tente novamente em instantes."
+                )
+            
+            if not probe and state == CircuitState.OPEN:
                 remaining = self._get_remaining_timeout()
                 logger.warning(f"[{self.name}] Circuit OPEN - tentativa bloqueada "
                              f"(recuperação em {remaining}s)")
-                raise CircuitBreakerError(
+                raise self.error_class(
                     f"Circuit breaker '{self.name}' está aberto. "
                     f"Tente novamente em {remaining} segundos."
                 )
         
-        try:
-            result = func(*args, **kwargs)
-            self._on_success()
-            return result
-            
-        except self.expected_exception as e:
-            self._on_failure()
-            raise
+        return probe
     
-    def _on_success(self):
+    def try_acquire_half_open(self) -> bool:
+        """
+        Reserva, de forma atômica, uma vaga de teste em HALF_OPEN.
+        
+        Se o circuito está OPEN e o timeout expirou, a thread que efetua a
+        transição OPEN -> HALF_OPEN leva a primeira vaga. No máximo
+        `half_open_max_probes` chamadas testam o serviço ao mesmo tempo; as
+        demais são rejeitadas sem tocar o serviço ainda instável.
+        
+        Returns:
+            True se a vaga foi reservada, False caso contrário
+        """
+        transitioned = False
+        with self._lock:
+            if self.state == CircuitState.OPEN:
+                if not self._should_attempt_reset():
+                    return False
+                self.state = CircuitState.HALF_OPEN
+                self._half_open_inflight = 0
+                self._half_open_successes = 0
+                transitioned = True
+            if self._half_open_inflight >= self.half_open_max_probes:
+                return False
+            self._half_open_inflight += 1
+        
+        if transitioned:
+            logger.info(f"[{self.name}] Tentando recuperação (HALF_OPEN)")
+        return True
+    
+    def _release_probe(self):
+        """Libera a vaga de teste sem contabilizar sucesso ou falha"""
+        with self._lock:
+            self._half_open_inflight = max(0, self._half_open_inflight - 1)
+    
+    def _on_success(self, probe: bool = False):
         """Chamado quando a requisição tem sucesso"""
-        self.failure_count = 0
+        with self._lock:
+            if probe:
+                self._half_open_inflight = max(0, self._half_open_inflight - 1)
+            self.failure_count = 0
+            recovered = False
+            if self.state == CircuitState.HALF_OPEN:
+                # Um único sucesso não basta: o serviço pode estar oscilando
+                self._half_open_successes += 1
+                half_open_successes = self._half_open_successes
+                recovered = half_open_successes >= self.success_threshold
+                if recovered:
+                    self.state = CircuitState.CLOSED
+                    self._half_open_successes = 0
+                    self.success_count += 1
+            else:
+                half_open_successes = 0
         
-        if self.state == CircuitState.HALF_OPEN:
+        if recovered:
             logger.info(f"[{self.name}] Recuperação bem-sucedida - CLOSED")
-            self.state = CircuitState.CLOSED
-            self.success_count += 1
+        elif half_open_successes:
+            logger.info(f"[{self.name}] HALF_OPEN: sucesso {half_open_successes}/{self.success_threshold}")
     
-    def _on_failure(self):
+    def _on_failure(self, probe: bool = False):
         """Chamado quando a requisição falha"""
-        self.failure_count += 1
-        self.last_failure_time = datetime.now()
+        with self._lock:
+            if probe:
+                self._half_open_inflight = max(0, self._half_open_inflight - 1)
+            self.failure_count += 1
+            failure_count = self.failure_count
+            self.last_failure_time_mono = self._now()
+            self.last_failure_wall = datetime.now()
+            self._last_failure_iso = None
+            # Qualquer falha em HALF_OPEN reabre o circuito
+            opened = (
+                self.state == CircuitState.HALF_OPEN
+                or failure_count >= self.failure_threshold
+            )
+            if opened:
+                self.state = CircuitState.OPEN
+                self._half_open_successes = 0
         
-        logger.warning(f"[{self.name}] Falha {self.failure_count}/{self.failure_threshold}")
+        logger.warning(f"[{self.name}] Falha {failure_count}/{self.failure_threshold}")
         
-        if self.failure_count >= self.failure_threshold:
+        if opened:
             logger.error(f"[{self.name}] Threshold atingido - Circuit OPEN por {self.recovery_timeout}s")
-            self.state = CircuitState.OPEN
     
     def _should_attempt_reset(self) -> bool:
         """Verifica se deve tentar resetar o circuito"""
-        if self.last_failure_time is None:
-            return False
-        
-        elapsed = (datetime.now() - self.last_failure_time).total_seconds()
-        return elapsed >= self.recovery_timeout
+        return (
+            self.last_failure_time_mono is not None
+            and self._now() - self.last_failure_time_mono >= self.recovery_timeout
+        )
     
     def _get_remaining_timeout(self) -> int:
         """Retorna tempo restante até tentativa de recuperação"""
-        if self.last_failure_time is None:
+        if self.last_failure_time_mono is None:
             return 0
         
-        elapsed = (datetime.now() - self.last_failure_time).total_seconds()
+        elapsed = self._now() - self.last_failure_time_mono
         remaining = max(0, self.recovery_timeout - elapsed)
         return int(remaining)
     
     def reset(self):
         """Reseta o circuit breaker manualmente"""
+        with self._lock:
+            self.state = CircuitState.CLOSED
+            self.failure_count = 0
+            self._half_open_inflight = 0
+            self._half_open_successes = 0
+            self.last_failure_time_mono = None
+            self.last_failure_wall = None
+            self._last_failure_iso = None
         logger.info(f"[{self.name}] Reset manual - CLOSED")
-        self.state = CircuitState.CLOSED
-        self.failure_count = 0
-        self.last_failure_time = None
     
     def get_stats(self) -> dict:
         """Retorna estatísticas do circuit breaker"""
-        return {
-            "name": self.name,
-            "state": self.state.value,
-            "failure_count": self.failure_count,
-            "success_count": self.success_count,
-            "failure_threshold": self.failure_threshold,
-            "recovery_timeout": self.recovery_timeout,
-            "last_failure": self.last_failure_time.isoformat() if self.last_failure_time else None,
-            "remaining_timeout": self._get_remaining_timeout() if self.state == CircuitState.OPEN else 0
-        }
+        with self._lock:
+            state = self.state
+            if self._last_failure_iso is None and self.last_failure_wall is not None:
+                self._last_failure_iso = self.last_failure_wall.isoformat()
+            stats = {
+                "name": self.name,
+                "state": state.value,
+                "failure_count": self.failure_count,
+                "success_count": self.success_count,
+                "half_open_successes": self._half_open_successes,
+                "success_threshold": self.success_threshold,
+                "failure_threshold": self.failure_threshold,
+                "recovery_timeout": self.recovery_timeout,
+                "last_failure": self._last_failure_iso,
+                "remaining_timeout": self._get_remaining_timeout() if state == CircuitState.OPEN else 0
+            }
+        return stats
@@ -3,11 +3,36 @@ Módulo de exceções customizadas e tratamento de erros.
 Fornece classes específicas para diferentes tipos de erro na aplicação.
 """
 
+import time
+import random
+import asyncio
 import logging
 from typing import Optional
 
+from app.utils.circuit_breaker import CircuitBreaker, CircuitState
+from app.utils.circuit_breaker import CircuitBreakerError as BaseCircuitBreakerError
+
 logger = logging.getLogger(__name__)
 
+__all__ = [
+    "ApplicationError",
+    "AIModelError",
+    "RateLimitError",
+    "DatabaseError",
+    "CacheError",
+    "ValidationError",
+    "CircuitBreakerError",
+    "RetryExhaustedError",
+    "CircuitBreaker",
+    "CircuitState",
+    "RetryConfig",
+    "retry_with_backoff",
+    "retry_with_backoff_async",
+    "gemini_circuit_breaker",
+    "chroma_circuit_breaker",
+    "redis_circuit_breaker",
+]
+
 
 class ApplicationError(Exception):
     """Exceção base para erros da aplicação."""
@@ -62,7 +87,7 @@ class ValidationError(ApplicationError):
         super().__init__(message, "VALIDATION_ERROR", 400)
 
 
-class CircuitBreakerError(ApplicationError):
+class CircuitBreakerError(ApplicationError, BaseCircuitBreakerError):
     """Erro do circuit breaker (serviço indisponível)."""
     
     def __init__(self, message: str = "Serviço temporariamente indisponível"):
@@ -76,88 +101,6 @@ class RetryExhaustedError(ApplicationError):
         super().__init__(message, "RETRY_EXHAUSTED", 503)
 
 
-class CircuitBreaker:
-    """
-    Implementação do padrão Circuit Breaker.
-    Evita requisições a serviços indisponíveis.
-    """
-    
-    def __init__(
-        self,
-        failure_threshold: int = 5,
-        recovery_timeout: int = 60,
-        expected_exception: type = Exception
-    ):
-        """
-        Inicializa o circuit breaker.
-        
-        Args:
-            failure_threshold: Número de falhas antes de abrir o circuito
-            recovery_timeout: Tempo em segundos antes de tentar recuperar
-            expected_exception: Tipo de exceção esperada
-        """
-        self.failure_threshold = failure_threshold
-        self.recovery_timeout = recovery_timeout
-        self.expected_exception = expected_exception
-        
-        self.failure_count = 0
-        self.last_failure_time = None
-        self.state = "CLOSED"  # CLOSED, OPEN, HALF_OPEN
-    
-    def call(self, func, *args, **kwargs):
-        """
-        Executa uma função com proteção de circuit breaker.
-        
-        Args:
-            func: Função a executar
-            *args: Argumentos posicionais
-            **kwargs: Argumentos nomeados
-            
-        Returns:
-            Resultado da função
-            
-        Raises:
-            CircuitBreakerError: Se circuito está aberto
-        """
-        import time
-        
-        if self.state == "OPEN":
-            # Verificar se pode transicionar para HALF_OPEN
-            if time.time() - self.last_failure_time >= self.recovery_timeout:
-                self.state = "HALF_OPEN"
-                logger.info("Circuit breaker em HALF_OPEN, tentando recuperar")
-            else:
-                raise CircuitBreakerError(
-                    f"Circuit breaker aberto. Tente novamente em "
-                    f"{int(self.recovery_timeout - (time.time() - self.last_failure_time))} segundos"
-                )
-        
-        try:
-            result = func(*args, **kwargs)
-            
-            # Sucesso - resetar
-            if self.state == "HALF_OPEN":
-                self.state = "CLOSED"
-                self.failure_count = 0
-                logger.info("Circuit breaker recuperado, voltando ao estado CLOSED")
-            
-            return result
-            
-        except self.expected_exception as e:
-            self.failure_count += 1
-            self.last_failure_time = time.time()
-            
-            if self.failure_count >= self.failure_threshold:
-                self.state = "OPEN"
-                logger.error(
-                    f"Circuit breaker aberto após {self.failure_count} falhas. "
-                    f"Serviço indisponível por {self.recovery_timeout}s"
-                )
-                raise CircuitBreakerError(str(e))
-            
-            raise
-
-
 class RetryConfig:
     """Configuração de retry."""
     
@@ -205,37 +148,101 @@ def retry_with_backoff(
     Raises:
         RetryExhaustedError: Se todas as tentativas falharem
     """
-    import time
-    import random
-    
     config = config or RetryConfig()
+    max_attempts = config.max_attempts
+    max_delay = config.max_delay
+    backoff_factor = config.backoff_factor
+    jitter = config.jitter
+    _random = random.random
+    sleep = time.sleep
+    
+    delay = min(config.initial_delay, max_delay)
+    start = time.monotonic()
     
-    for attempt in range(1, config.max_attempts + 1):
+    for attempt in range(1, max_attempts + 1):
         try:
-            logger.debug(f"Tentativa {attempt}/{config.max_attempts}")
+            logger.debug(f"Tentativa {attempt}/{max_attempts}")
             return func()
             
         except expected_exceptions as e:
-            if attempt == config.max_attempts:
-                logger.error(f"Todas as {config.max_attempts} tentativas falharam")
+            if attempt == max_attempts:
+                logger.error(
+                    f"Todas as {max_attempts} tentativas falharam "
+                    f"em {time.monotonic() - start:.2f}s"
+                )
                 raise RetryExhaustedError(str(e))
             
-            # Calcular delay
-            delay = min(
-                config.initial_delay * (config.backoff_factor ** (attempt - 1)),
-                config.max_delay
+            # Jitter multiplica o delay por um fator em [0.5, 1.5)
+            wait = delay * (0.5 + _random()) if jitter else delay
+            
+            logger.warning(
+                f"Tentativa {attempt} falhou. Aguardando {wait:.2f}s "
+                f"antes da próxima tentativa. Erro: {str(e)}"
             )
             
-            # Adicionar jitter
-            if config.jitter:
-                delay = delay * (0.5 + random.random())
+            sleep(wait)
+            # Backoff exponencial acumulado (sem recalcular a potência)
+            delay = min(delay * backoff_factor, max_delay)
+    
+    raise RetryExhaustedError("Erro ao executar função com retry")
+
+
+async def retry_with_backoff_async(
+    func,
+    config: Optional[RetryConfig] = None,
+    expected_exceptions: tuple = (Exception,)
+):
+    """
+    Versão assíncrona de `retry_with_backoff`.
+    
+    Aguarda `func()` (coroutine) e espera entre tentativas com
+    `asyncio.sleep`, liberando o event loop durante o backoff.
+    
+    Args:
+        func: Função assíncrona (sem argumentos) a executar
+        config: Configuração de retry
+        expected_exceptions: Exceções que acionam retry
+        
+    Returns:
+        Resultado da coroutine
+        
+    Raises:
+        RetryExhaustedError: Se todas as tentativas falharem
+    """
+    config = config or RetryConfig()
+    max_attempts = config.max_attempts
+    max_delay = config.max_delay
+    backoff_factor = config.backoff_factor
+    jitter = config.jitter
+    _random = random.random
+    
+    delay = min(config.initial_delay, max_delay)
+    start = time.monotonic()
+    
+    for attempt in range(1, max_attempts + 1):
+        try:
+            logger.debug(f"Tentativa {attempt}/{max_attempts}")
+            return await func()
+            
+        except expected_exceptions as e:
+            if attempt == max_attempts:
+                logger.error(
+                    f"Todas as {max_attempts} tentativas falharam "
+                    f"em {time.monotonic() - start:.2f}s"
+                )
+                raise RetryExhaustedError(str(e))
+            
+            # Jitter multiplica o delay por um fator em [0.5, 1.5)
+            wait = delay * (0.5 + _random()) if jitter else delay
             
             logger.warning(
-                f"Tentativa {attempt} falhou. Aguardando {delay:.2f}s "
+                f"Tentativa {attempt} falhou. Aguardando {wait:.2f}s "
                 f"antes da próxima tentativa. Erro: {str(e)}"
             )
             
-            time.sleep(delay)
+            await asyncio.sleep(wait)
+            # Backoff exponencial acumulado (sem recalcular a potência)
+            delay = min(delay * backoff_factor, max_delay)
     
     raise RetryExhaustedError("Erro ao executar função com retry")
 
@@ -244,17 +251,23 @@ def retry_with_backoff(
 gemini_circuit_breaker = CircuitBreaker(
     failure_threshold=3,
     recovery_timeout=30,
-    expected_exception=(AIModelError, RateLimitError)
+    expected_exception=(AIModelError, RateLimitError),
+    name="Gemini",
+    error_class=CircuitBreakerError
 )
 
 chroma_circuit_breaker = CircuitBreaker(
     failure_threshold=5,
     recovery_timeout=60,
-    expected_exception=DatabaseError
+    expected_exception=DatabaseError,
+    name="ChromaDB",
+    error_class=CircuitBreakerError
 )
 
 redis_circuit_breaker = CircuitBreaker(
     failure_threshold=3,
     recovery_timeout=30,
-    expected_exception=CacheError
+    expected_exception=CacheError,
+    name="Redis",
+    error_class=CircuitBreakerError
 )
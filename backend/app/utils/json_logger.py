@@ -4,12 +4,33 @@ Facilita parsing por ferramentas de análise de logs (ELK, Grafana Loki, etc).
 """
 
 import json
+import time
+import queue
+import atexit
 import logging
+import logging.handlers
 import sys
-from datetime import datetime
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Optional, Tuple
 from pathlib import Path
 
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+    orjson = None
+
+# Campos padrão do LogRecord (não são tratados como extras)
+_STANDARD_FIELDS = frozenset({
+    'name', 'msg', 'args', 'created', 'filename', 'funcName', 'levelname',
+    'levelno', 'lineno', 'module', 'msecs', 'message', 'pathname',
+    'process', 'processName', 'relativeCreated', 'thread', 'threadName',
+    'exc_info', 'exc_text', 'stack_info', 'taskName'
+})
+
+# Tipos serializáveis diretamente (conteúdo de containers cai no default=str)
+_JSON_NATIVE_TYPES = (str, int, float, bool, type(None), list, dict, tuple)
+
 
 class JSONFormatter(logging.Formatter):
     """
@@ -21,19 +42,35 @@ class JSONFormatter(logging.Formatter):
         self,
         service_name: str = "agent-database-api",
         environment: str = "development",
-        include_extra: bool = True
+        include_extra: bool = True,
+        include_source: bool = False,
+        include_process: bool = False
     ):
         """
         Args:
             service_name: Nome do serviço
             environment: Ambiente (development, staging, production)
             include_extra: Se deve incluir campos extras do LogRecord
+            include_source: Inclui arquivo/linha/função em todos os níveis
+            include_process: Inclui processo/thread em todos os níveis
+            
+        Registros WARNING ou acima sempre incluem source e process.
         """
         super().__init__()
         self.service_name = service_name
         self.environment = environment
         self.include_extra = include_extra
+        self.include_source = include_source
+        self.include_process = include_process
         self.hostname = self._get_hostname()
+        # (segundo, prefixo ISO) do último registro formatado
+        self._ts_cache: Tuple[int, str] = (-1, "")
+        # Campos estáticos, montados uma única vez
+        self._base = {
+            "service": self.service_name,
+            "environment": self.environment,
+            "hostname": self.hostname,
+        }
     
     def format(self, record: logging.LogRecord) -> str:
         """
@@ -45,32 +82,39 @@ class JSONFormatter(logging.Formatter):
         Returns:
             String JSON
         """
+        # Sem args (caso comum) a mensagem é o próprio msg: evita o %-formatting
+        message = record.msg
+        if record.args or not isinstance(message, str):
+            message = record.getMessage()
+        
         # Campos base
         log_data = {
-            "timestamp": datetime.utcfromtimestamp(record.created).isoformat() + "Z",
+            "timestamp": self._format_timestamp(record.created),
             "level": record.levelname,
             "logger": record.name,
-            "message": record.getMessage(),
-            "service": self.service_name,
-            "environment": self.environment,
-            "hostname": self.hostname,
+            "message": message,
+            **self._base,
         }
         
+        is_warning = record.levelno >= logging.WARNING
+        
         # Adiciona informações de código
-        log_data["source"] = {
-            "file": record.pathname,
-            "line": record.lineno,
-            "function": record.funcName,
-            "module": record.module,
-        }
+        if self.include_source or is_warning:
+            log_data["source"] = {
+                "file": record.pathname,
+                "line": record.lineno,
+                "function": record.funcName,
+                "module": record.module,
+            }
         
         # Adiciona informações de thread/processo
-        log_data["process"] = {
-            "id": record.process,
-            "name": record.processName,
-            "thread_id": record.thread,
-            "thread_name": record.threadName,
-        }
+        if self.include_process or is_warning:
+            log_data["process"] = {
+                "id": record.process,
+                "name": record.processName,
+                "thread_id": record.thread,
+                "thread_name": record.threadName,
+            }
         
         # Adiciona exception info se presente
         if record.exc_info:
@@ -102,27 +146,38 @@ class JSONFormatter(logging.Formatter):
         if hasattr(record, 'request_id'):
             log_data["request_id"] = record.request_id
         
-        return json.dumps(log_data, ensure_ascii=False)
+        return self._dumps(log_data)
+    
+    def _format_timestamp(self, created: float) -> str:
+        """
+        Timestamp ISO 8601 (UTC, milissegundos). A parte até os segundos é
+        reaproveitada entre todos os registros do mesmo segundo.
+        """
+        secs = int(created)
+        cached_secs, prefix = self._ts_cache
+        if secs != cached_secs:
+            prefix = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(secs))
+            self._ts_cache = (secs, prefix)
+        return f"{prefix}.{int((created - secs) * 1000):03d}Z"
+    
+    @staticmethod
+    def _dumps(log_data: Dict[str, Any]) -> str:
+        """Serializa com orjson quando disponível, senão com json da stdlib"""
+        if ORJSON_AVAILABLE:
+            try:
+                return orjson.dumps(log_data, default=str, option=orjson.OPT_NON_STR_KEYS).decode()
+            except TypeError:
+                # Ex.: inteiros acima de 64 bits
+                pass
+        return json.dumps(log_data, ensure_ascii=False, default=str)
     
     def _extract_extra_fields(self, record: logging.LogRecord) -> Dict[str, Any]:
         """Extrai campos extras do LogRecord"""
-        # Campos padrão do LogRecord
-        standard_fields = {
-            'name', 'msg', 'args', 'created', 'filename', 'funcName', 'levelname',
-            'levelno', 'lineno', 'module', 'msecs', 'message', 'pathname',
-            'process', 'processName', 'relativeCreated', 'thread', 'threadName',
-            'exc_info', 'exc_text', 'stack_info', 'taskName'
-        }
-        
         extra = {}
         for key, value in record.__dict__.items():
-            if key not in standard_fields and not key.startswith('_'):
-                # Converte valores não-serializáveis
-                try:
-                    json.dumps(value)
-                    extra[key] = value
-                except (TypeError, ValueError):
-                    extra[key] = str(value)
+            if key not in _STANDARD_FIELDS and key[0] != '_':
+                # Tipos nativos do JSON passam direto; o resto vira string
+                extra[key] = value if isinstance(value, _JSON_NATIVE_TYPES) else str(value)
         
         return extra
     
@@ -135,12 +190,53 @@ class JSONFormatter(logging.Formatter):
             return "unknown"
 
 
+class _JSONQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler da configuração JSON.
+    
+    Com o JSONFormatter anexado, o `prepare` padrão serializa o registro uma
+    única vez (já com exceção/stack) e enfileira o JSON pronto; os handlers
+    do listener apenas escrevem `%(message)s`.
+    """
+
+
+# Listener ativo (escrita dos logs em thread de fundo)
+_listener: Optional[logging.handlers.QueueListener] = None
+
+# Argumentos da última configuração aplicada, para setups repetidos
+_setup_fingerprint: Optional[Tuple] = None
+
+# Bibliotecas com logs verbosos
+_NOISY_LOGGERS = ("urllib3", "asyncio", "chromadb")
+
+
+def _stop_listener():
+    """Para o listener atual, esvaziando a fila e fechando os handlers"""
+    global _listener
+    if _listener is None:
+        return
+    
+    listener, _listener = _listener, None
+    listener.stop()
+    for handler in listener.handlers:
+        handler.close()
+
+
+atexit.register(_stop_listener)
+
+
 class StructuredLogger:
     """
     Logger wrapper para facilitar logging estruturado.
     Adiciona contexto automaticamente aos logs.
     """
     
+    DEBUG = logging.DEBUG
+    INFO = logging.INFO
+    WARNING = logging.WARNING
+    ERROR = logging.ERROR
+    CRITICAL = logging.CRITICAL
+    
     def __init__(
         self,
         name: str,
@@ -165,50 +261,60 @@ class StructuredLogger:
     
     def _add_context(self, extra: Optional[Dict] = None) -> Dict:
         """Adiciona contexto aos logs"""
-        log_extra = self.context.copy()
-        
-        if self.correlation_id:
-            log_extra['correlation_id'] = self.correlation_id
-        if self.user_id:
-            log_extra['user_id'] = self.user_id
-        if self.request_id:
-            log_extra['request_id'] = self.request_id
-        
-        if extra:
-            log_extra.update(extra)
-        
-        return log_extra
+        return {
+            **self.context,
+            **{
+                key: value
+                for key, value in (
+                    ('correlation_id', self.correlation_id),
+                    ('user_id', self.user_id),
+                    ('request_id', self.request_id),
+                )
+                if value
+            },
+            **(extra or {}),
+        }
     
+    # Os métodos abaixo só montam o contexto se o nível estiver habilitado
     def debug(self, message: str, **extra):
         """Log debug com contexto"""
-        self.logger.debug(message, extra=self._add_context(extra))
+        if self.logger.isEnabledFor(self.DEBUG):
+            self.logger.debug(message, extra=self._add_context(extra))
     
     def info(self, message: str, **extra):
         """Log info com contexto"""
-        self.logger.info(message, extra=self._add_context(extra))
+        if self.logger.isEnabledFor(self.INFO):
+            self.logger.info(message, extra=self._add_context(extra))
     
     def warning(self, message: str, **extra):
         """Log warning com contexto"""
-        self.logger.warning(message, extra=self._add_context(extra))
+        if self.logger.isEnabledFor(self.WARNING):
+            self.logger.warning(message, extra=self._add_context(extra))
     
     def error(self, message: str, **extra):
         """Log error com contexto"""
-        self.logger.error(message, extra=self._add_context(extra))
+        if self.logger.isEnabledFor(self.ERROR):
+            self.logger.error(message, extra=self._add_context(extra))
     
     def critical(self, message: str, **extra):
         """Log critical com contexto"""
-        self.logger.critical(message, extra=self._add_context(extra))
+        if self.logger.isEnabledFor(self.CRITICAL):
+            self.logger.critical(message, extra=self._add_context(extra))
     
     def exception(self, message: str, **extra):
         """Log exception com contexto e traceback"""
-        self.logger.exception(message, extra=self._add_context(extra))
+        if self.logger.isEnabledFor(self.ERROR):
+            self.logger.exception(message, extra=self._add_context(extra))
 
 
 def setup_json_logging(
     service_name: str = "agent-database-api",
     environment: str = "development",
     log_level: str = "INFO",
-    log_file: Optional[str] = None
+    log_file: Optional[str] = None,
+    include_source: bool = False,
+    include_process: bool = False,
+    capture_metadata: bool = True
 ):
     """
     Configura logging em JSON para toda a aplicação.
@@ -218,11 +324,30 @@ def setup_json_logging(
         environment: Ambiente
         log_level: Nível de log (DEBUG, INFO, WARNING, ERROR, CRITICAL)
         log_file: Caminho para arquivo de log (opcional)
+        include_source: Inclui source (arquivo/linha) também abaixo de WARNING
+        include_process: Inclui process/thread também abaixo de WARNING
+        capture_metadata: Se False, o logging deixa de coletar thread/processo
+            em cada LogRecord (campos de `process` ficam nulos)
     """
-    # Remove handlers existentes
+    global _listener, _setup_fingerprint
+    
+    # Chamadas repetidas com os mesmos argumentos não recriam os handlers
+    fingerprint = (
+        service_name, environment, log_level, log_file,
+        include_source, include_process, capture_metadata
+    )
     root_logger = logging.getLogger()
+    if (
+        fingerprint == _setup_fingerprint
+        and _listener is not None
+        and any(isinstance(h, _JSONQueueHandler) for h in root_logger.handlers)
+    ):
+        return
+    
+    # Remove handlers existentes (e o listener de uma configuração anterior)
     for handler in root_logger.handlers[:]:
         root_logger.removeHandler(handler)
+    _stop_listener()
     
     # Configura nível de log
     root_logger.setLevel(getattr(logging, log_level.upper()))
@@ -230,13 +355,18 @@ def setup_json_logging(
     # Cria formatter JSON
     formatter = JSONFormatter(
         service_name=service_name,
-        environment=environment
+        environment=environment,
+        include_source=include_source,
+        include_process=include_process
     )
     
+    # Os handlers finais recebem o JSON já formatado pelo QueueHandler
+    passthrough = logging.Formatter("%(message)s")
+    
     # Handler para console (stdout)
     console_handler = logging.StreamHandler(sys.stdout)
-    console_handler.setFormatter(formatter)
-    root_logger.addHandler(console_handler)
+    console_handler.setFormatter(passthrough)
+    handlers = [console_handler]
     
     # Handler para arquivo se especificado
     if log_file:
@@ -244,20 +374,41 @@ def setup_json_logging(
         log_path.parent.mkdir(parents=True, exist_ok=True)
         
         file_handler = logging.FileHandler(log_file, encoding='utf-8')
-        file_handler.setFormatter(formatter)
-        root_logger.addHandler(file_handler)
+        file_handler.setFormatter(passthrough)
+        handlers.append(file_handler)
+    
+    # As threads da aplicação apenas enfileiram; a escrita (stdout/arquivo)
+    # acontece na thread do QueueListener
+    log_queue = queue.SimpleQueue()
+    queue_handler = _JSONQueueHandler(log_queue)
+    queue_handler.setFormatter(formatter)
+    root_logger.addHandler(queue_handler)
+    _listener = logging.handlers.QueueListener(
+        log_queue, *handlers, respect_handler_level=True
+    )
+    _listener.start()
     
     # Desabilita logs verbose de bibliotecas
-    logging.getLogger("urllib3").setLevel(logging.WARNING)
-    logging.getLogger("asyncio").setLevel(logging.WARNING)
-    logging.getLogger("chromadb").setLevel(logging.WARNING)
+    for name in _NOISY_LOGGERS:
+        logging.getLogger(name).setLevel(logging.WARNING)
     
-    root_logger.info(
-        f"JSON logging configurado",
-        extra={
-            "service": service_name,
-            "environment": environment,
-            "log_level": log_level,
-            "log_file": log_file
-        }
-    )
+    _setup_fingerprint = fingerprint
+    
+    # Coleta de thread/processo por LogRecord (flags globais do módulo logging)
+    logging.logThreads = capture_metadata
+    logging.logProcesses = capture_metadata
+    logging.logMultiprocessing = capture_metadata
+    
+    # Registro de início montado diretamente: a origem é conhecida, sem findCaller()
+    if root_logger.isEnabledFor(logging.INFO):
+        root_logger.handle(root_logger.makeRecord(
+            root_logger.name, logging.INFO, __file__, 0,
+            "JSON logging configurado", None, None,
+            func="setup_json_logging",
+            extra={
+                "service": service_name,
+                "environment": environment,
+                "log_level": log_level,
+                "log_file": log_file
+            }
+        ))
@@ -2,7 +2,8 @@
 Helper de logging com prints customizados e coloridos.
 Substitui logger.info/error por prints mais bonitos.
 """
-from datetime import datetime
+import sys
+import time
 from typing import Optional
 
 # Cores ANSI
@@ -33,40 +34,53 @@ EMOJIS = {
 }
 
 
+# Formatos pré-montados por nível: uma única interpolação por chamada
+_FMT = {
+    'info': f"{COLORS['GREEN']}{{emoji}}{COLORS['RESET']} {{msg}} às {COLORS['DIM']}{{ts}}{COLORS['RESET']}\n",
+    'success': f"{COLORS['GREEN']}✅{COLORS['RESET']} {{msg}} às {COLORS['DIM']}{{ts}}{COLORS['RESET']}\n",
+    'warning': f"{COLORS['YELLOW']}⚠️{COLORS['RESET']}  {{msg}} às {COLORS['DIM']}{{ts}}{COLORS['RESET']}\n",
+    'error': f"{COLORS['RED']}❌{COLORS['RESET']} {{msg}} às {COLORS['DIM']}{{ts}}{COLORS['RESET']}\n",
+    'debug': f"{COLORS['BLUE']}🔍{COLORS['RESET']} {{msg}} às {COLORS['DIM']}{{ts}}{COLORS['RESET']}\n",
+}
+
+# (segundo, timestamp formatado) da última chamada
+_ts_cache = (-1, "")
+
+
 def _get_timestamp() -> str:
-    """Retorna timestamp formatado."""
-    return datetime.now().strftime('%H:%M:%S')
+    """Retorna timestamp formatado (recalculado no máximo uma vez por segundo)."""
+    global _ts_cache
+    secs = int(time.time())
+    cached_secs, ts = _ts_cache
+    if secs != cached_secs:
+        ts = time.strftime('%H:%M:%S', time.localtime(secs))
+        _ts_cache = (secs, ts)
+    return ts
 
 
 def log_info(message: str, emoji: str = 'info', module: Optional[str] = None):
     """Log de informação."""
-    ts = _get_timestamp()
-    emoji_str = EMOJIS.get(emoji, '✓')
-    print(f"{COLORS['GREEN']}{emoji_str}{COLORS['RESET']} {message} às {COLORS['DIM']}{ts}{COLORS['RESET']}")
+    sys.stdout.write(_FMT['info'].format(emoji=EMOJIS.get(emoji, '✓'), msg=message, ts=_get_timestamp()))
 
 
 def log_success(message: str, module: Optional[str] = None):
     """Log de sucesso."""
-    ts = _get_timestamp()
-    print(f"{COLORS['GREEN']}✅{COLORS['RESET']} {message} às {COLORS['DIM']}{ts}{COLORS['RESET']}")
+    sys.stdout.write(_FMT['success'].format(msg=message, ts=_get_timestamp()))
 
 
 def log_warning(message: str, module: Optional[str] = None):
     """Log de aviso."""
-    ts = _get_timestamp()
-    print(f"{COLORS['YELLOW']}⚠️{COLORS['RESET']}  {message} às {COLORS['DIM']}{ts}{COLORS['RESET']}")
+    sys.stdout.write(_FMT['warning'].format(msg=message, ts=_get_timestamp()))
 
 
 def log_error(message: str, module: Optional[str] = None):
     """Log de erro."""
-    ts = _get_timestamp()
-    print(f"{COLORS['RED']}❌{COLORS['RESET']} {message} às {COLORS['DIM']}{ts}{COLORS['RESET']}")
+    sys.stdout.write(_FMT['error'].format(msg=message, ts=_get_timestamp()))
 
 
 def log_debug(message: str, module: Optional[str] = None):
     """Log de debug."""
-    ts = _get_timestamp()
-    print(f"{COLORS['BLUE']}🔍{COLORS['RESET']} {message} às {COLORS['DIM']}{ts}{COLORS['RESET']}")
+    sys.stdout.write(_FMT['debug'].format(msg=message, ts=_get_timestamp()))
 
 
 def log_separator(char: str = "─", length: int = 50):
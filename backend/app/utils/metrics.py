@@ -3,32 +3,241 @@ Sistema de métricas para monitoramento de performance.
 Compatível com Prometheus e pode ser expandido para outros sistemas.
 """
 
+import math
 import time
+import asyncio
+import functools
 import logging
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional, Tuple
 from datetime import datetime
 from collections import defaultdict
-from threading import Lock
+from threading import Lock, local
+
+import numpy as np
 
 logger = logging.getLogger(__name__)
 
+# Histograma log-linear (estilo HDR): buckets geométricos entre HIST_MIN e HIST_MAX
+HIST_MIN = 1e-6
+HIST_MAX = 1e6
+# Buckets por década: razão 10**(1/48) ~ 1.049, erro relativo < 2.5% nos quantis
+HIST_BUCKETS_PER_DECADE = 48
+_HIST_SCALE = HIST_BUCKETS_PER_DECADE / math.log(10)
+_HIST_LOG_MIN = math.log(HIST_MIN)
+# Bucket 0: valores <= HIST_MIN; último bucket: valores > HIST_MAX
+_HIST_SIZE = int(round(math.log10(HIST_MAX / HIST_MIN) * HIST_BUCKETS_PER_DECADE)) + 2
+# Limite superior de cada bucket (o último é +Inf)
+HIST_UPPER_BOUNDS = np.append(
+    np.geomspace(HIST_MIN, HIST_MAX, _HIST_SIZE - 1), np.inf
+)
+# Buckets exportados como `le` no Prometheus: um por década
+_PROM_BUCKET_IDX = np.arange(HIST_BUCKETS_PER_DECADE, _HIST_SIZE - 1, HIST_BUCKETS_PER_DECADE)
+_PROM_BUCKET_LE = [f"{b:g}" for b in HIST_UPPER_BOUNDS[_PROM_BUCKET_IDX].tolist()]
+
+
+class LogHistogram:
+    """
+    Histograma de buckets logarítmicos com tamanho fixo.
+    
+    observe() é O(1) e não guarda amostras: apenas incrementa o bucket e
+    atualiza count/sum/min/max exatos. Histogramas de shards diferentes são
+    combinados somando as contagens.
+    """
+    
+    __slots__ = ("counts", "count", "total", "min", "max")
+    
+    def __init__(self):
+        # Lista de ints: incremento escalar mais barato que em ndarray;
+        # convertida para numpy apenas na leitura
+        self.counts = [0] * _HIST_SIZE
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+    
+    def observe(self, value: float):
+        if value > HIST_MIN:
+            idx = int((math.log(value) - _HIST_LOG_MIN) * _HIST_SCALE) + 1
+            if idx >= _HIST_SIZE:
+                idx = _HIST_SIZE - 1
+        else:
+            idx = 0
+        self.counts[idx] += 1
+        self.count += 1
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+    
+    def merge(self, other: "LogHistogram"):
+        """Acumula `other` neste histograma"""
+        self.counts = (np.asarray(self.counts, dtype=np.int64) + np.asarray(other.counts, dtype=np.int64)).tolist()
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+    
+    def copy(self) -> "LogHistogram":
+        clone = LogHistogram()
+        clone.counts = list(self.counts)
+        clone.count = self.count
+        clone.total = self.total
+        clone.min = self.min
+        clone.max = self.max
+        return clone
+    
+    def cumulative(self) -> np.ndarray:
+        """Contagens acumuladas por bucket"""
+        return np.cumsum(np.asarray(self.counts, dtype=np.int64))
+    
+    def quantiles(self, qs: List[float]) -> List[float]:
+        """
+        Quantis aproximados via soma acumulada + searchsorted.
+        
+        Cada quantil é o ponto médio geométrico do bucket, limitado a [min, max].
+        """
+        cum = self.cumulative()
+        ranks = [int(self.count * q) for q in qs]
+        idxs = np.searchsorted(cum, ranks, side="right")
+        result = []
+        for idx in idxs.tolist():
+            if idx == 0:
+                value = self.min
+            elif idx >= _HIST_SIZE - 1:
+                value = self.max
+            else:
+                value = math.sqrt(HIST_UPPER_BOUNDS[idx - 1] * HIST_UPPER_BOUNDS[idx])
+            result.append(min(max(value, self.min), self.max))
+        return result
+
+
+def _summarize(hist: LogHistogram) -> Tuple[int, float, float, float, float, float, float, float]:
+    """Calcula (count, sum, min, max, avg, p50, p95, p99) de um histograma"""
+    p50, p95, p99 = hist.quantiles([0.5, 0.95, 0.99])
+    return (hist.count, hist.total, hist.min, hist.max, hist.total / hist.count, p50, p95, p99)
+
+
+# (segundo, timestamp ISO) do último get_metrics
+_ts_cache = (-1, "")
+
+
+def _iso_timestamp() -> str:
+    """Timestamp ISO com resolução de segundo (formatado no máximo uma vez por segundo)"""
+    global _ts_cache
+    secs = int(time.time())
+    cached_secs, ts = _ts_cache
+    if secs != cached_secs:
+        ts = datetime.fromtimestamp(secs).isoformat()
+        _ts_cache = (secs, ts)
+    return ts
+
+
+@functools.lru_cache(maxsize=4096)
+def _make_key_cached(name: str, labels: frozenset) -> str:
+    """
+    Chave `nome{k=v,...}` com labels ordenados.
+    
+    Labels são conjuntos pequenos e finitos (endpoint, status...), então o
+    cache evita o sorted + join a cada incremento.
+    """
+    label_str = ",".join(f"{k}={v}" for k, v in sorted(labels))
+    return f"{name}{{{label_str}}}"
+
+
+class _MetricsShard:
+    """Contadores e observações escritos por uma única thread"""
+    
+    __slots__ = ("counters", "counter_vals", "histograms", "timings")
+    
+    def __init__(self):
+        self.counters: Dict[str, int] = defaultdict(int)
+        # Contadores por ID (ver MetricsCollector.counter_id), indexados por posição
+        self.counter_vals: List[int] = []
+        self.histograms: Dict[str, LogHistogram] = defaultdict(LogHistogram)
+        self.timings: Dict[str, LogHistogram] = defaultdict(LogHistogram)
+    
+    def clear(self):
+        self.counters.clear()
+        self.counter_vals.clear()
+        self.histograms.clear()
+        self.timings.clear()
+
 
 class MetricsCollector:
     """
     Coletor de métricas centralizado.
     Armazena contadores, histogramas e gauges em memória.
+    
+    Contadores, histogramas e timings ficam em shards por thread: a escrita
+    não usa lock e os shards são somados na leitura. Histogramas e timings
+    usam buckets logarítmicos (LogHistogram), sem guardar amostras. Gauges e
+    labels são gravações únicas em dict (atômicas sob o GIL). O lock protege
+    apenas o registro de shards, os snapshots de leitura e o reset.
     """
     
     def __init__(self):
         self._lock = Lock()
-        self._counters: Dict[str, int] = defaultdict(int)
+        self._local = local()
+        self._shards: List[_MetricsShard] = []
         self._gauges: Dict[str, float] = {}
-        self._histograms: Dict[str, list] = defaultdict(list)
-        self._timings: Dict[str, list] = defaultdict(list)
         self._labels: Dict[str, Dict[str, Any]] = {}
+        # Nomes de contadores internados: nome -> ID e ID -> nome
+        self._counter_ids: Dict[str, int] = {}
+        self._counter_names: List[str] = []
+        # Chave da métrica -> nome sanitizado para o formato Prometheus
+        self._prom_names: Dict[str, str] = {}
+        # Último texto Prometheus renderizado (servido por /metrics)
+        self._snapshot: str = ""
         
         logger.info("MetricsCollector inicializado")
     
+    def _shard(self) -> _MetricsShard:
+        """Shard da thread atual (registrado no primeiro uso)"""
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = _MetricsShard()
+            with self._lock:
+                self._shards.append(shard)
+            self._local.shard = shard
+            return shard
+    
+    def inc(self, name: str, value: int = 1) -> None:
+        """
+        Incrementa um contador sem labels (caminho rápido).
+        
+        Apenas um `+=` no dict do shard da thread: sem _make_key, sem lock.
+        Para contadores com labels use increment_counter.
+        """
+        self._shard().counters[name] += value
+    
+    def counter_id(self, name: str) -> int:
+        """
+        Interna o nome de um contador sem labels e retorna seu ID inteiro.
+        
+        Chamado uma vez (ex.: no import do módulo); o ID é então passado a
+        inc_id, que incrementa por posição sem hash do nome.
+        """
+        try:
+            return self._counter_ids[name]
+        except KeyError:
+            with self._lock:
+                cid = self._counter_ids.get(name)
+                if cid is None:
+                    cid = self._counter_ids[name] = len(self._counter_names)
+                    self._counter_names.append(name)
+            return cid
+    
+    def inc_id(self, counter: int, value: int = 1) -> None:
+        """Incrementa o contador de ID `counter` (obtido via counter_id)"""
+        vals = self._shard().counter_vals
+        try:
+            vals[counter] += value
+        except IndexError:
+            vals.extend([0] * (counter + 1 - len(vals)))
+            vals[counter] += value
+    
     def increment_counter(self, name: str, value: int = 1, labels: Optional[Dict[str, str]] = None):
         """
         Incrementa um contador.
@@ -38,11 +247,10 @@ class MetricsCollector:
             value: Valor a incrementar
             labels: Labels adicionais para a métrica
         """
-        with self._lock:
-            key = self._make_key(name, labels)
-            self._counters[key] += value
-            if labels:
-                self._labels[key] = labels
+        key = self._make_key(name, labels)
+        self._shard().counters[key] += value
+        if labels:
+            self._labels.setdefault(key, labels)
     
     def set_gauge(self, name: str, value: float, labels: Optional[Dict[str, str]] = None):
         """
@@ -53,11 +261,10 @@ class MetricsCollector:
             value: Valor atual
             labels: Labels adicionais
         """
-        with self._lock:
-            key = self._make_key(name, labels)
-            self._gauges[key] = value
-            if labels:
-                self._labels[key] = labels
+        key = self._make_key(name, labels)
+        self._gauges[key] = value
+        if labels:
+            self._labels.setdefault(key, labels)
     
     def observe_histogram(self, name: str, value: float, labels: Optional[Dict[str, str]] = None):
         """
@@ -68,14 +275,10 @@ class MetricsCollector:
             value: Valor observado
             labels: Labels adicionais
         """
-        with self._lock:
-            key = self._make_key(name, labels)
-            self._histograms[key].append(value)
-            # Mantém apenas as últimas 1000 observações
-            if len(self._histograms[key]) > 1000:
-                self._histograms[key] = self._histograms[key][-1000:]
-            if labels:
-                self._labels[key] = labels
+        key = self._make_key(name, labels)
+        self._shard().histograms[key].observe(value)
+        if labels:
+            self._labels.setdefault(key, labels)
     
     def record_timing(self, name: str, duration_seconds: float, labels: Optional[Dict[str, str]] = None):
         """
@@ -86,14 +289,10 @@ class MetricsCollector:
             duration_seconds: Duração em segundos
             labels: Labels adicionais
         """
-        with self._lock:
-            key = self._make_key(name, labels)
-            self._timings[key].append(duration_seconds)
-            # Mantém apenas os últimos 1000 registros
-            if len(self._timings[key]) > 1000:
-                self._timings[key] = self._timings[key][-1000:]
-            if labels:
-                self._labels[key] = labels
+        key = self._make_key(name, labels)
+        self._shard().timings[key].observe(duration_seconds)
+        if labels:
+            self._labels.setdefault(key, labels)
     
     def get_metrics(self) -> Dict[str, Any]:
         """
@@ -103,14 +302,47 @@ class MetricsCollector:
             Dicionário com todas as métricas
         """
         with self._lock:
-            metrics = {
-                "timestamp": datetime.now().isoformat(),
-                "counters": dict(self._counters),
-                "gauges": dict(self._gauges),
-                "histograms": self._calculate_histogram_stats(),
-                "timings": self._calculate_timing_stats()
-            }
-            return metrics
+            shards = list(self._shards)
+            gauges = dict(self._gauges)
+        
+        return {
+            "timestamp": _iso_timestamp(),
+            "counters": self._merge_counters(shards),
+            "gauges": gauges,
+            "histograms": self._calculate_histogram_stats(self._merge_observations(shards, "histograms")),
+            "timings": self._calculate_timing_stats(self._merge_observations(shards, "timings"))
+        }
+    
+    def _merge_counters(self, shards: List[_MetricsShard]) -> Dict[str, int]:
+        """Soma os contadores de todos os shards"""
+        merged: Dict[str, int] = defaultdict(int)
+        names = list(self._counter_names)
+        totals = np.zeros(len(names), dtype=np.int64)
+        for shard in shards:
+            # list() copia os itens de uma vez, sem intercalar com escritas
+            for key, value in list(shard.counters.items()):
+                merged[key] += value
+            vals = list(shard.counter_vals)[:len(names)]
+            if vals:
+                totals[:len(vals)] += vals
+        # Contadores por ID: soma vetorizada; IDs nunca incrementados ficam de fora
+        for cid in np.flatnonzero(totals).tolist():
+            merged[names[cid]] += int(totals[cid])
+        return dict(merged)
+    
+    @staticmethod
+    def _merge_observations(shards: List[_MetricsShard], kind: str) -> Dict[str, LogHistogram]:
+        """Combina os histogramas de cada métrica em todos os shards"""
+        merged: Dict[str, LogHistogram] = {}
+        for shard in shards:
+            for key, hist in list(getattr(shard, kind).items()):
+                if not hist.count:
+                    continue
+                if key in merged:
+                    merged[key].merge(hist)
+                else:
+                    merged[key] = hist.copy()
+        return merged
     
     def get_prometheus_format(self) -> str:
         """
@@ -119,66 +351,109 @@ class MetricsCollector:
         Returns:
             String formatada para Prometheus
         """
+        with self._lock:
+            shards = list(self._shards)
+            gauges = dict(self._gauges)
+        
+        prom_name = self._prom_name
         lines = []
         
         # Counters
-        for name, value in self._counters.items():
-            metric_name = name.replace(".", "_").replace("-", "_")
-            lines.append(f"# TYPE {metric_name} counter")
-            lines.append(f"{metric_name} {value}")
+        for name, value in self._merge_counters(shards).items():
+            metric_name = prom_name(name)
+            lines += (f"# TYPE {metric_name} counter", f"{metric_name} {value}")
         
         # Gauges
-        for name, value in self._gauges.items():
-            metric_name = name.replace(".", "_").replace("-", "_")
-            lines.append(f"# TYPE {metric_name} gauge")
-            lines.append(f"{metric_name} {value}")
-        
-        # Histograms (simplificado)
-        for name, values in self._histograms.items():
-            if values:
-                metric_name = name.replace(".", "_").replace("-", "_")
-                lines.append(f"# TYPE {metric_name} histogram")
-                lines.append(f"{metric_name}_sum {sum(values)}")
-                lines.append(f"{metric_name}_count {len(values)}")
-                lines.append(f"{metric_name}_avg {sum(values)/len(values)}")
+        for name, value in gauges.items():
+            metric_name = prom_name(name)
+            lines += (f"# TYPE {metric_name} gauge", f"{metric_name} {value}")
+        
+        # Histograms: buckets cumulativos `le` (um por década), +Inf, soma e contagem
+        for name, hist in self._merge_observations(shards, "histograms").items():
+            metric_name, _, label_str = prom_name(name).partition("{")
+            label_str = label_str.rstrip("}")
+            sep = "," if label_str else ""
+            cum = hist.cumulative()[_PROM_BUCKET_IDX].tolist()
+            lines.append(f"# TYPE {metric_name} histogram")
+            lines += (
+                f'{metric_name}_bucket{{{label_str}{sep}le="{le}"}} {c}'
+                for le, c in zip(_PROM_BUCKET_LE, cum)
+            )
+            suffix = f"{{{label_str}}}" if label_str else ""
+            lines += (
+                f'{metric_name}_bucket{{{label_str}{sep}le="+Inf"}} {hist.count}',
+                f"{metric_name}_sum{suffix} {hist.total}",
+                f"{metric_name}_count{suffix} {hist.count}",
+            )
         
         return "\n".join(lines) + "\n"
     
-    def _calculate_histogram_stats(self) -> Dict[str, Dict[str, float]]:
+    def get_prometheus_snapshot(self) -> str:
+        """
+        Texto Prometheus pré-renderizado por start_snapshot_task.
+        
+        Antes da primeira rotação renderiza na hora, para o scrape nunca vir vazio.
+        """
+        if not self._snapshot:
+            self._snapshot = self.get_prometheus_format()
+        return self._snapshot
+    
+    async def start_snapshot_task(self, interval: float = 5):
+        """
+        Re-renderiza o snapshot Prometheus a cada `interval` segundos.
+        
+        Deve rodar como task de fundo (asyncio.create_task); o endpoint
+        /metrics apenas lê o último snapshot.
+        """
+        logger.info(f"Snapshot de métricas iniciado (intervalo={interval}s)")
+        while True:
+            try:
+                self._snapshot = self.get_prometheus_format()
+            except Exception as e:
+                logger.error(f"Erro ao renderizar snapshot de métricas: {e}")
+            await asyncio.sleep(interval)
+    
+    def _prom_name(self, key: str) -> str:
+        """Nome sanitizado da métrica (calculado uma vez por chave)"""
+        try:
+            return self._prom_names[key]
+        except KeyError:
+            metric_name = self._prom_names[key] = key.replace(".", "_").replace("-", "_")
+            return metric_name
+    
+    def _calculate_histogram_stats(self, observations: Dict[str, LogHistogram]) -> Dict[str, Dict[str, float]]:
         """Calcula estatísticas para histogramas"""
         stats = {}
-        for name, values in self._histograms.items():
-            if values:
-                sorted_values = sorted(values)
-                count = len(sorted_values)
+        for name, hist in observations.items():
+            if hist.count:
+                count, total, vmin, vmax, avg, p50, p95, p99 = _summarize(hist)
                 stats[name] = {
                     "count": count,
-                    "sum": sum(sorted_values),
-                    "min": sorted_values[0],
-                    "max": sorted_values[-1],
-                    "avg": sum(sorted_values) / count,
-                    "p50": sorted_values[int(count * 0.5)],
-                    "p95": sorted_values[int(count * 0.95)],
-                    "p99": sorted_values[int(count * 0.99)] if count > 1 else sorted_values[-1]
+                    "sum": total,
+                    "min": vmin,
+                    "max": vmax,
+                    "avg": avg,
+                    "p50": p50,
+                    "p95": p95,
+                    "p99": p99
                 }
         return stats
     
-    def _calculate_timing_stats(self) -> Dict[str, Dict[str, float]]:
+    def _calculate_timing_stats(self, observations: Dict[str, LogHistogram]) -> Dict[str, Dict[str, float]]:
         """Calcula estatísticas para timings"""
         stats = {}
-        for name, values in self._timings.items():
-            if values:
-                sorted_values = sorted(values)
-                count = len(sorted_values)
+        for name, hist in observations.items():
+            if hist.count:
+                count, total, vmin, vmax, avg, p50, p95, p99 = _summarize(hist)
                 stats[name] = {
                     "count": count,
-                    "total_seconds": sum(sorted_values),
-                    "min_seconds": sorted_values[0],
-                    "max_seconds": sorted_values[-1],
-                    "avg_seconds": sum(sorted_values) / count,
-                    "p50_seconds": sorted_values[int(count * 0.5)],
-                    "p95_seconds": sorted_values[int(count * 0.95)],
-                    "p99_seconds": sorted_values[int(count * 0.99)] if count > 1 else sorted_values[-1]
+                    "total_seconds": total,
+                    "min_seconds": vmin,
+                    "max_seconds": vmax,
+                    "avg_seconds": avg,
+                    "p50_seconds": p50,
+                    "p95_seconds": p95,
+                    "p99_seconds": p99
                 }
         return stats
     
@@ -186,16 +461,14 @@ class MetricsCollector:
         """Cria chave única para métrica com labels"""
         if not labels:
             return name
-        label_str = ",".join(f"{k}={v}" for k, v in sorted(labels.items()))
-        return f"{name}{{{label_str}}}"
+        return _make_key_cached(name, frozenset(labels.items()))
     
     def reset(self):
         """Reseta todas as métricas"""
         with self._lock:
-            self._counters.clear()
+            for shard in self._shards:
+                shard.clear()
             self._gauges.clear()
-            self._histograms.clear()
-            self._timings.clear()
             self._labels.clear()
             logger.warning("Métricas resetadas")
 
@@ -207,14 +480,15 @@ class Timer:
         self.collector = collector
         self.metric_name = metric_name
         self.labels = labels
-        self.start_time = None
+        self.start_ns: Optional[int] = None
     
     def __enter__(self):
-        self.start_time = time.time()
+        # perf_counter_ns: monotônico e sem arredondamento de float na leitura
+        self.start_ns = time.perf_counter_ns()
         return self
     
     def __exit__(self, exc_type, exc_val, exc_tb):
-        duration = time.time() - self.start_time
+        duration = (time.perf_counter_ns() - self.start_ns) * 1e-9
         self.collector.record_timing(self.metric_name, duration, self.labels)
         return False
 
@@ -4,8 +4,7 @@ Evita ultrapassar os limites do tier gratuito
 """
 import time
 import asyncio
-from collections import deque
-from typing import Dict
+from typing import Dict, Optional
 import logging
 
 logger = logging.getLogger(__name__)
@@ -13,46 +12,62 @@ logger = logging.getLogger(__name__)
 
 class RateLimiter:
     """
-    Rate Limiter simples baseado em janela deslizante
+    Rate Limiter baseado em token bucket
     Controla quantas requisições podem ser feitas por minuto
+    
+    Os tokens são repostos continuamente (requests_per_minute / 60 por
+    segundo) e calculados sob demanda em cada acquire: O(1), sem fila de
+    timestamps. Não há lock: no event loop, a leitura e a reserva do token
+    acontecem sem await entre elas, e quem precisa esperar já sai com o
+    token reservado (saldo negativo), o que espaça os waiters na ordem de
+    chegada.
+    
+    Em qualquer janela de 60s passam no máximo requests_per_minute + burst
+    requisições; o burst padrão (25% do limite) cabe na margem de 20%
+    deixada abaixo dos limites reais do Gemini.
     """
 
-    def __init__(self, requests_per_minute: int = 10):
+    def __init__(self, requests_per_minute: int = 10, burst: Optional[int] = None):
         """
         Args:
             requests_per_minute: Número máximo de requisições por minuto
+            burst: Requisições permitidas de uma vez (padrão: 25% do limite, mínimo 1)
         """
         self.requests_per_minute = requests_per_minute
-        self.request_times: deque = deque()
-        self.lock = asyncio.Lock()
+        self.burst = burst if burst is not None else max(1, requests_per_minute // 4)
+        self.rate = requests_per_minute / 60.0
+        self.tokens: float = float(self.burst)
+        self.last: float = time.monotonic()
 
     async def acquire(self):
         """
         Aguarda até que seja seguro fazer uma nova requisição.
-        Implementa janela deslizante de 60 segundos.
         """
-        async with self.lock:
-            current_time = time.time()
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
 
-            # Remove requisições antigas (fora da janela de 1 minuto)
-            while self.request_times and current_time - self.request_times[0] > 60:
-                self.request_times.popleft()
+        # Reserva o token antes de qualquer await
+        self.tokens -= 1
 
-            # Se atingiu o limite, aguarda
-            if len(self.request_times) >= self.requests_per_minute:
-                oldest_request = self.request_times[0]
-                wait_time = 60 - (current_time - oldest_request)
+        if self.tokens < 0:
+            wait_time = -self.tokens / self.rate
+            logger.warning(f"⏳ Rate limit atingido. Aguardando {wait_time:.2f}s antes da próxima requisição...")
+            await asyncio.sleep(wait_time)
 
-                if wait_time > 0:
-                    logger.warning(f"⏳ Rate limit atingido. Aguardando {wait_time:.2f}s antes da próxima requisição...")
-                    await asyncio.sleep(wait_time)
+        logger.debug(f"✓ Requisição permitida (limite {self.requests_per_minute} RPM)")
 
-                    # Remove a requisição mais antiga após aguardar
-                    self.request_times.popleft()
 
-            # Registra a nova requisição
-            self.request_times.append(time.time())
-            logger.debug(f"✓ Requisição permitida ({len(self.request_times)}/{self.requests_per_minute} no último minuto)")
+class _LimiterRegistry(dict):
+    """Dict de limiters que cria, sob demanda, o limiter padrão para modelos desconhecidos"""
+
+    DEFAULT_RPM = 5
+
+    def __missing__(self, model_name: str) -> RateLimiter:
+        # Chamado apenas no primeiro acesso: o aviso sai uma vez por modelo
+        logger.warning(f"Modelo {model_name} não configurado. Usando limite padrão de {self.DEFAULT_RPM} RPM")
+        limiter = self[model_name] = RateLimiter(requests_per_minute=self.DEFAULT_RPM)
+        return limiter
 
 
 class MultiModelRateLimiter:
@@ -62,7 +77,7 @@ class MultiModelRateLimiter:
     """
 
     def __init__(self):
-        self.limiters: Dict[str, RateLimiter] = {}
+        self.limiters: Dict[str, RateLimiter] = _LimiterRegistry()
 
         # Configuração dos limites por modelo (tier gratuito)
         # Usamos 80% do limite real para ter margem de segurança
@@ -85,11 +100,7 @@ class MultiModelRateLimiter:
         Args:
             model_name: Nome do modelo Gemini
         """
-        # Se o modelo não está na lista, usa um limiter padrão conservador
-        if model_name not in self.limiters:
-            logger.warning(f"Modelo {model_name} não configurado. Usando limite padrão de 5 RPM")
-            self.limiters[model_name] = RateLimiter(requests_per_minute=5)
-
+        # Modelos fora da lista recebem um limiter padrão conservador (__missing__)
         await self.limiters[model_name].acquire()
 
 
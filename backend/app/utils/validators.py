@@ -12,22 +12,54 @@ logger = logging.getLogger(__name__)
 
 # Padrões de segurança
 SAFE_COLLECTION_NAME_PATTERN = re.compile(r'^[a-zA-Z0-9_\-\.]+$')
+UUID_V4_PATTERN = re.compile(
+    r'^[a-f0-9]{8}-[a-f0-9]{4}-4[a-f0-9]{3}-[89ab][a-f0-9]{3}-[a-f0-9]{12}$',
+    re.IGNORECASE
+)
+
+# Tabela para str.translate: remove caracteres de controle (inclui \x00) exceto \t, \n, \r
+_CONTROL_CHARS = {c: None for c in range(32) if c not in (9, 10, 13)}
 SQL_INJECTION_PATTERNS = [
     r"(\b(SELECT|INSERT|UPDATE|DELETE|DROP|CREATE|ALTER|EXEC|EXECUTE)\b)",
     r"(;|\-\-|\/\*|\*\/|xp_|sp_)",
     r"(\bOR\b.*=.*|\bAND\b.*=.*)",
     r"(\'|\"|`)",
 ]
+# Padrões XSS que são substrings fixas: testados com `in` sobre o texto em
+# minúsculas (busca de substring nativa, sem o case-folding do regex)
+XSS_SUBSTRINGS = ("javascript:", "<iframe", "<embed", "<object")
+# Padrões XSS que precisam de regex
 XSS_PATTERNS = [
-    r"<script[^>]*>.*?</script>",
-    r"javascript:",
+    r"(?s:<script[^>]*>.*?</script>)",  # (?s:...) também casa scripts multilinha
     r"on\w+\s*=",
-    r"<iframe",
-    r"<embed",
-    r"<object"
 ]
 
 
+def _fuse_patterns(patterns: List[str], flags: int = 0) -> re.Pattern:
+    """
+    Combina os padrões numa única alternação pré-compilada (uma varredura
+    do texto). Cada alternativa fica num grupo nomeado p<i> para identificar
+    qual padrão casou.
+    """
+    return re.compile("|".join(f"(?P<p{i}>{p})" for i, p in enumerate(patterns)), flags)
+
+
+SQL_INJECTION_RE = _fuse_patterns(SQL_INJECTION_PATTERNS, re.IGNORECASE)
+XSS_RE = _fuse_patterns(XSS_PATTERNS, re.IGNORECASE)
+# SQL injection + XSS (regex) numa única varredura (usado por validate_chat_message)
+DANGER_PATTERNS = SQL_INJECTION_PATTERNS + XSS_PATTERNS
+DANGER_RE = _fuse_patterns(DANGER_PATTERNS, re.IGNORECASE)
+
+
+def _find_xss_substring(text: str) -> Optional[str]:
+    """Retorna a primeira substring de XSS_SUBSTRINGS presente no texto (ignorando caixa)"""
+    lowered = text.lower()
+    for substring in XSS_SUBSTRINGS:
+        if substring in lowered:
+            return substring
+    return None
+
+
 class InputValidator:
     """Classe para validação de inputs"""
     
@@ -49,11 +81,8 @@ class InputValidator:
         # Limita tamanho
         value = value[:max_length]
         
-        # Remove null bytes
-        value = value.replace('\x00', '')
-        
-        # Remove caracteres de controle exceto \n, \r, \t
-        value = ''.join(char for char in value if ord(char) >= 32 or char in ['\n', '\r', '\t'])
+        # Remove null bytes e caracteres de controle exceto \n, \r, \t
+        value = value.translate(_CONTROL_CHARS)
         
         return value.strip()
     
@@ -84,14 +113,13 @@ class InputValidator:
         Returns:
             True se detectar padrão suspeito, False caso contrário
         """
-        text_upper = text.upper()
-        
-        for pattern in SQL_INJECTION_PATTERNS:
-            if re.search(pattern, text_upper, re.IGNORECASE):
-                logger.warning(f"Possível SQL injection detectado: {pattern}")
-                return True
+        match = SQL_INJECTION_RE.search(text)
+        if match is None:
+            return False
         
-        return False
+        pattern = SQL_INJECTION_PATTERNS[int(match.lastgroup[1:])]
+        logger.warning(f"Possível SQL injection detectado: {pattern}")
+        return True
     
     @staticmethod
     def check_xss(text: str) -> bool:
@@ -104,12 +132,15 @@ class InputValidator:
         Returns:
             True se detectar padrão suspeito, False caso contrário
         """
-        for pattern in XSS_PATTERNS:
-            if re.search(pattern, text, re.IGNORECASE):
-                logger.warning(f"Possível XSS detectado: {pattern}")
-                return True
-        
-        return False
+        pattern = _find_xss_substring(text)
+        if pattern is None:
+            match = XSS_RE.search(text)
+            if match is None:
+                return False
+            pattern = XSS_PATTERNS[int(match.lastgroup[1:])]
+        
+        logger.warning(f"Possível XSS detectado: {pattern}")
+        return True
     
     @staticmethod
     def validate_chat_message(message: str, max_length: int = 10000) -> tuple[bool, Optional[str]]:
@@ -129,12 +160,17 @@ class InputValidator:
         if len(message) > max_length:
             return False, f"Mensagem muito longa (máximo {max_length} caracteres)"
         
-        # Verifica SQL injection
-        if InputValidator.check_sql_injection(message):
+        # Verifica SQL injection e XSS numa única varredura
+        match = DANGER_RE.search(message)
+        if match is not None:
+            index = int(match.lastgroup[1:])
+            kind = "SQL injection" if index < len(SQL_INJECTION_PATTERNS) else "XSS"
+            logger.warning(f"Possível {kind} detectado: {DANGER_PATTERNS[index]}")
             return False, "Mensagem contém padrões suspeitos"
         
-        # Verifica XSS
-        if InputValidator.check_xss(message):
+        substring = _find_xss_substring(message)
+        if substring is not None:
+            logger.warning(f"Possível XSS detectado: {substring}")
             return False, "Mensagem contém padrões suspeitos"
         
         return True, None
@@ -153,13 +189,7 @@ class InputValidator:
         if not conv_id:
             return False, "ID vazio"
         
-        # UUID v4 pattern
-        uuid_pattern = re.compile(
-            r'^[a-f0-9]{8}-[a-f0-9]{4}-4[a-f0-9]{3}-[89ab][a-f0-9]{3}-[a-f0-9]{12}$',
-            re.IGNORECASE
-        )
-        
-        if not uuid_pattern.match(conv_id):
+        if not UUID_V4_PATTERN.match(conv_id):
             return False, "ID inválido (deve ser UUID v4)"
         
         return True, None
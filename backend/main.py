@@ -1,10 +1,15 @@
+import asyncio
 import logging
 import sys
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from app.config.settings import settings
 from app.config.logging_config import setup_logging
 from app.utils.logger import log_info, log_header, log_footer
+from app.utils.metrics import metrics_collector
+from app.services.chroma_service import chroma_service
 from app.api import chat
 
 # Desabilitar logs verbose do Uvicorn
@@ -19,7 +24,28 @@ setup_logging()
 log_header("🚀 Agent Database API")
 log_info("Iniciando servidor...", emoji='rocket', module='STARTUP')
 
-app = FastAPI(title="AI Agent Database API")
+# Intervalo (segundos) entre renderizações do snapshot servido em /metrics
+METRICS_SNAPSHOT_INTERVAL = 5
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Task de fundo que mantém o snapshot de /metrics atualizado
+    metrics_task = asyncio.create_task(
+        metrics_collector.start_snapshot_task(METRICS_SNAPSHOT_INTERVAL)
+    )
+    # Índice de centróides montado em thread: a primeira busca não amostra
+    # todas as collections dentro do handler assíncrono
+    asyncio.get_running_loop().run_in_executor(None, chroma_service.warm_centroid_index)
+    try:
+        yield
+    finally:
+        metrics_task.cancel()
+        try:
+            await metrics_task
+        except asyncio.CancelledError:
+            pass
+
+app = FastAPI(title="AI Agent Database API", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -35,5 +61,12 @@ app.include_router(chat.router, prefix="/api")
 async def health_check():
     return {"status": "healthy"}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    return PlainTextResponse(
+        metrics_collector.get_prometheus_snapshot(),
+        media_type="text/plain; version=0.0.4"
+    )
+
 log_footer()
 log_info("✨ Servidor pronto para receber requisições!", emoji='rocket', module='STARTUP')
\ No newline at end of file
@@ -4,6 +4,7 @@ Execute com: python test_toons.py
 """
 
 import sys
+from functools import lru_cache
 from pathlib import Path
 
 # Adicionar o diretório backend ao path
@@ -22,6 +23,15 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+@lru_cache(maxsize=16)
+def _cc(context: str) -> dict:
+    """
+    compress_context memoizado para as entradas fixas do script.
+    Não usar em test_cache: lá a chamada repetida precisa chegar ao otimizador.
+    """
+    return toons_optimizer.compress_context(context)
+
+
 def test_compression():
     """Testa a compressão de contexto."""
     print("\n" + "="*60)
@@ -46,7 +56,7 @@ def test_compression():
     """
     
     logger.info(f"Contexto original: {len(context)} caracteres")
-    result = toons_optimizer.compress_context(context)
+    result = _cc(context)
     
     print(f"\n✓ Tamanho original: {result['original_length']} caracteres")
     print(f"✓ Tamanho comprimido: {result['compressed_length']} caracteres")
@@ -1,28 +1,9 @@
 import os
 from dotenv import load_dotenv
 from analyzer.sql_analyzer import SQLServerAnalyzer
+from analyzer.connection import build_connection_string
 from analyzer.report_generator import DatabaseReport
 
-def build_connection_string():
-    host = os.getenv('SQL_SERVER_HOST')
-    database = os.getenv('SQL_SERVER_DATABASE')
-    use_windows_auth = os.getenv('SQL_SERVER_USE_WINDOWS_AUTH', 'False').lower() == 'true'
-    trust_cert = os.getenv('SQL_SERVER_TRUST_CERTIFICATE', 'False').lower() == 'true'
-    user = os.getenv('SQL_SERVER_USER')
-    password = os.getenv('SQL_SERVER_PASSWORD')
-
-    conn_str = f"DRIVER={{ODBC Driver 17 for SQL Server}};SERVER={host};DATABASE={database};"
-
-    if use_windows_auth:
-        conn_str += "Trusted_Connection=yes;"
-    else:
-        conn_str += f"UID={user};PWD={password};"
-
-    if trust_cert:
-        conn_str += "TrustServerCertificate=yes;"
-
-    return conn_str, host, database
-
 def main():
     load_dotenv()
 
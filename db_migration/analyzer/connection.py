@@ -0,0 +1,26 @@
+import os
+import functools
+
+@functools.lru_cache(maxsize=4)
+def _template(windows: bool, trust: bool) -> str:
+    """Template da connection string para a combinação de autenticação/certificado"""
+    template = "DRIVER={{ODBC Driver 17 for SQL Server}};SERVER={host};DATABASE={database};"
+    template += "Trusted_Connection=yes;" if windows else "UID={user};PWD={password};"
+    if trust:
+        template += "TrustServerCertificate=yes;"
+    return template
+
+def build_connection_string():
+    host = os.getenv('SQL_SERVER_HOST')
+    database = os.getenv('SQL_SERVER_DATABASE')
+    use_windows_auth = os.getenv('SQL_SERVER_USE_WINDOWS_AUTH', 'False').lower() == 'true'
+    trust_cert = os.getenv('SQL_SERVER_TRUST_CERTIFICATE', 'False').lower() == 'true'
+
+    conn_str = _template(use_windows_auth, trust_cert).format(
+        host=host,
+        database=database,
+        user=os.getenv('SQL_SERVER_USER'),
+        password=os.getenv('SQL_SERVER_PASSWORD')
+    )
+
+    return conn_str, host, database
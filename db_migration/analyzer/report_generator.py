@@ -1,8 +1,20 @@
 import json
-from typing import List
+from collections import deque
+from typing import Iterator, List
 from .sql_analyzer import TableInfo
 import numpy as np
 
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+    orjson = None
+
+# Tipos que convert_to_native converte (os demais já são serializáveis)
+_NUMPY_TYPES = (np.generic, np.ndarray)
+
+
 class DatabaseReport:
     def __init__(self, tables: List[TableInfo]):
         self.tables = tables
@@ -18,75 +30,92 @@ class DatabaseReport:
         return obj
 
     def generate_summary(self) -> dict:
-        total_rows = sum(t.row_count for t in self.tables)
-        total_columns = sum(len(t.columns) for t in self.tables)
+        # Uma única passada: lista de tabelas e totais juntos
+        tables = []
+        total_rows = 0
+        total_columns = 0
+        for t in self.tables:
+            column_count = len(t.columns)
+            total_rows += t.row_count
+            total_columns += column_count
+            tables.append({
+                "name": f"{t.schema}.{t.name}",
+                "columns": column_count,
+                "rows": t.row_count,
+                "has_relationships": bool(t.relationships)
+            })
 
         return {
             "total_tables": len(self.tables),
-            "total_rows": int(total_rows),
-            "total_columns": int(total_columns),
-            "tables": [
-                {
-                    "name": f"{t.schema}.{t.name}",
-                    "columns": len(t.columns),
-                    "rows": int(t.row_count),
-                    "has_relationships": len(t.relationships) > 0
-                }
-                for t in self.tables
-            ]
+            "total_rows": total_rows,
+            "total_columns": total_columns,
+            "tables": tables
         }
 
-    def generate_text_report(self) -> str:
+    def iter_text_report(self) -> Iterator[str]:
+        """Linhas do relatório em texto, geradas sob demanda"""
         summary = self.generate_summary()
-        report = []
-
-        report.append("="*60)
-        report.append("RELATÓRIO DE ANÁLISE DO BANCO DE DADOS")
-        report.append("="*60)
-        report.append(f"\nTotal de Tabelas: {summary['total_tables']}")
-        report.append(f"Total de Linhas: {summary['total_rows']:,}")
-        report.append(f"Total de Colunas: {summary['total_columns']}")
-        report.append("\n" + "-"*60)
-        report.append("DETALHES DAS TABELAS")
-        report.append("-"*60)
+
+        yield "="*60
+        yield "RELATÓRIO DE ANÁLISE DO BANCO DE DADOS"
+        yield "="*60
+        yield f"\nTotal de Tabelas: {summary['total_tables']}"
+        yield f"Total de Linhas: {summary['total_rows']:,}"
+        yield f"Total de Colunas: {summary['total_columns']}"
+        yield "\n" + "-"*60
+        yield "DETALHES DAS TABELAS"
+        yield "-"*60
 
         for table in self.tables:
-            report.append(f"\n📊 {table.schema}.{table.name}")
-            report.append(f"   Linhas: {table.row_count:,}")
-            report.append(f"   Colunas: {len(table.columns)}")
+            yield f"\n📊 {table.schema}.{table.name}"
+            yield f"   Linhas: {table.row_count:,}"
+            yield f"   Colunas: {len(table.columns)}"
 
             if table.relationships:
-                report.append(f"   Relacionamentos: {len(table.relationships)}")
+                yield f"   Relacionamentos: {len(table.relationships)}"
                 for rel in table.relationships:
-                    report.append(f"      └─ {rel['column_name']} → {rel['referenced_table']}.{rel['referenced_column']}")
+                    yield f"      └─ {rel['column_name']} → {rel['referenced_table']}.{rel['referenced_column']}"
 
-            report.append("\n   Estrutura:")
+            yield "\n   Estrutura:"
             for col in table.columns:
                 nullable = "NULL" if col['IS_NULLABLE'] == 'YES' else "NOT NULL"
                 max_len = f"({col['CHARACTER_MAXIMUM_LENGTH']})" if col['CHARACTER_MAXIMUM_LENGTH'] else ""
-                report.append(f"      • {col['COLUMN_NAME']}: {col['DATA_TYPE']}{max_len} {nullable}")
+                yield f"      • {col['COLUMN_NAME']}: {col['DATA_TYPE']}{max_len} {nullable}"
 
-        return "\n".join(report)
+    def generate_text_report(self) -> str:
+        return "\n".join(self.iter_text_report())
 
     def save_json(self, filepath: str):
         summary = self.generate_summary()
 
-        def convert_values(obj):
-            if isinstance(obj, dict):
-                return {k: convert_values(v) for k, v in obj.items()}
-            elif isinstance(obj, list):
-                return [convert_values(item) for item in obj]
-            else:
-                return self.convert_to_native(obj)
+        if ORJSON_AVAILABLE:
+            # orjson serializa tipos numpy em C, sem percorrer o dicionário
+            with open(filepath, 'wb') as f:
+                f.write(orjson.dumps(
+                    summary,
+                    option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS
+                ))
+            print(f"   📄 JSON: {filepath}")
+            return
 
-        clean_summary = convert_values(summary)
+        # Fallback sem orjson: converte tipos numpy no próprio dicionário
+        # (recém-criado por generate_summary) com uma pilha, sem recursão
+        stack = deque([summary])
+        while stack:
+            node = stack.pop()
+            items = node.items() if isinstance(node, dict) else enumerate(node)
+            for key, value in items:
+                if isinstance(value, (dict, list)):
+                    stack.append(value)
+                elif isinstance(value, _NUMPY_TYPES):
+                    node[key] = self.convert_to_native(value)
 
         with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(clean_summary, f, indent=2, ensure_ascii=False)
+            json.dump(summary, f, indent=2, ensure_ascii=False)
         print(f"   📄 JSON: {filepath}")
 
     def save_text(self, filepath: str):
-        report = self.generate_text_report()
-        with open(filepath, 'w', encoding='utf-8') as f:
-            f.write(report)
+        # Escreve linha a linha, sem montar o relatório inteiro em memória
+        with open(filepath, 'w', encoding='utf-8', buffering=1 << 20) as f:
+            f.writelines(line + "\n" for line in self.iter_text_report())
         print(f"   📝 TXT: {filepath}")
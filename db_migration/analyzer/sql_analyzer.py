@@ -1,6 +1,7 @@
 import pandas as pd
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator, Optional, Tuple
 from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
 from sqlalchemy import create_engine, text
 from sqlalchemy.engine import Engine
 import urllib.parse
@@ -8,7 +9,14 @@ import warnings
 
 warnings.filterwarnings('ignore', category=UserWarning, module='pandas')
 
-@dataclass
+# Threads (e conexões do pool) usados para analisar tabelas em paralelo
+ANALYZE_WORKERS = 16
+# Linhas trazidas do servidor por ida ao enumerar tabelas
+TABLE_FETCH_SIZE = 1000
+# Linhas por fetchmany ao ler amostras grandes
+SAMPLE_FETCH_CHUNK = 1000
+
+@dataclass(slots=True)
 class TableInfo:
     name: str
     schema: str
@@ -20,6 +28,10 @@ class SQLServerAnalyzer:
     def __init__(self, connection_string: str):
         self.odbc_connection_string = connection_string
         self.engine: Engine = None
+        # Metadados em lote (preenchidos por prefetch_metadata), chave (schema, tabela)
+        self._columns: Optional[Dict[Tuple[str, str], List[Dict[str, Any]]]] = None
+        self._foreign_keys: Optional[Dict[Tuple[str, str], List[Dict[str, Any]]]] = None
+        self._row_counts: Optional[Dict[Tuple[str, str], int]] = None
 
     def connect(self):
         try:
@@ -31,6 +43,8 @@ class SQLServerAnalyzer:
             self.engine = create_engine(
                 sqlalchemy_url,
                 fast_executemany=True,
+                pool_size=ANALYZE_WORKERS,
+                max_overflow=0,
                 echo=False
             )
 
@@ -44,18 +58,66 @@ class SQLServerAnalyzer:
             print(f"💥 Erro: {e}")
             return False
 
-    def get_all_tables(self) -> List[str]:
+    def _fetch_rows(self, sql: str, params: tuple = ()) -> Tuple[List[str], List[tuple]]:
+        """
+        Executa a consulta direto no cursor pyodbc (parâmetros `?`), sem
+        montar DataFrame. Retorna (nomes das colunas, linhas).
+        """
+        conn = self.engine.raw_connection()
+        try:
+            cur = conn.cursor()
+            cur.execute(sql, params)
+            cols = [c[0] for c in cur.description]
+            rows = cur.fetchall()
+            cur.close()
+        finally:
+            conn.close()
+        return cols, rows
+
+    def _fetch_dicts(self, sql: str, params: tuple = ()) -> List[Dict[str, Any]]:
+        """Como _fetch_rows, mas cada linha vira um dict coluna -> valor"""
+        cols, rows = self._fetch_rows(sql, params)
+        return [dict(zip(cols, row)) for row in rows]
+
+    def get_all_tables(self) -> List[Tuple[str, str]]:
+        return list(self.iter_all_tables())
+
+    def iter_all_tables(self) -> Iterator[Tuple[str, str]]:
+        """
+        Gera (schema, tabela) à medida que as linhas chegam do servidor, em
+        blocos de TABLE_FETCH_SIZE, sem materializar a lista inteira. A
+        conexão fica reservada até o gerador terminar (ou ser fechado).
+        """
         query = """
         SELECT TABLE_SCHEMA, TABLE_NAME
         FROM INFORMATION_SCHEMA.TABLES
         WHERE TABLE_TYPE = 'BASE TABLE'
         ORDER BY TABLE_SCHEMA, TABLE_NAME
         """
-        df = pd.read_sql(query, self.engine)
-        return [(row['TABLE_SCHEMA'], row['TABLE_NAME']) for _, row in df.iterrows()]
+        conn = self.engine.raw_connection()
+        try:
+            cur = conn.cursor()
+            cur.arraysize = TABLE_FETCH_SIZE
+            cur.execute(query)
+            while True:
+                rows = cur.fetchmany()
+                if not rows:
+                    break
+                for schema, table in rows:
+                    yield schema, table
+            cur.close()
+        finally:
+            conn.close()
+
+    def count_all_tables(self) -> int:
+        """Total de tabelas de usuário (para barras de progresso)"""
+        _, rows = self._fetch_rows(
+            "SELECT COUNT(*) FROM INFORMATION_SCHEMA.TABLES WHERE TABLE_TYPE = 'BASE TABLE'"
+        )
+        return int(rows[0][0])
 
     def get_table_columns(self, schema: str, table: str) -> List[Dict[str, Any]]:
-        query = text("""
+        query = """
         SELECT
             COLUMN_NAME,
             DATA_TYPE,
@@ -63,22 +125,37 @@ class SQLServerAnalyzer:
             IS_NULLABLE,
             COLUMN_DEFAULT
         FROM INFORMATION_SCHEMA.COLUMNS
-        WHERE TABLE_SCHEMA = :schema AND TABLE_NAME = :table
+        WHERE TABLE_SCHEMA = ? AND TABLE_NAME = ?
         ORDER BY ORDINAL_POSITION
-        """)
-        df = pd.read_sql(query, self.engine, params={"schema": schema, "table": table})
-        return df.to_dict('records')
+        """
+        return self._fetch_dicts(query, (schema, table))
 
     def get_table_row_count(self, schema: str, table: str) -> int:
+        """
+        Contagem via sys.dm_db_partition_stats (metadado, sem varrer a tabela;
+        pode estar levemente desatualizada). COUNT(*) só quando a DMV não
+        retorna valor.
+        """
+        query = """
+        SELECT SUM(row_count) AS cnt
+        FROM sys.dm_db_partition_stats
+        WHERE object_id = OBJECT_ID(?) AND index_id IN (0, 1)
+        """
+        try:
+            _, rows = self._fetch_rows(query, (f"[{schema}].[{table}]",))
+            if rows and rows[0][0] is not None:
+                return int(rows[0][0])
+        except Exception:
+            pass
+
         try:
-            query = text(f"SELECT COUNT(*) as cnt FROM [{schema}].[{table}]")
-            df = pd.read_sql(query, self.engine)
-            return int(df['cnt'].iloc[0])
+            _, rows = self._fetch_rows(f"SELECT COUNT(*) as cnt FROM [{schema}].[{table}]")
+            return int(rows[0][0])
         except:
             return 0
 
     def get_foreign_keys(self, schema: str, table: str) -> List[Dict[str, Any]]:
-        query = text("""
+        query = """
         SELECT
             fk.name AS constraint_name,
             OBJECT_NAME(fk.parent_object_id) AS table_name,
@@ -88,19 +165,106 @@ class SQLServerAnalyzer:
         FROM sys.foreign_keys AS fk
         INNER JOIN sys.foreign_key_columns AS fc
             ON fk.object_id = fc.constraint_object_id
-        WHERE OBJECT_SCHEMA_NAME(fk.parent_object_id) = :schema
-            AND OBJECT_NAME(fk.parent_object_id) = :table
-        """)
+        WHERE OBJECT_SCHEMA_NAME(fk.parent_object_id) = ?
+            AND OBJECT_NAME(fk.parent_object_id) = ?
+        """
         try:
-            df = pd.read_sql(query, self.engine, params={"schema": schema, "table": table})
-            return df.to_dict('records')
+            return self._fetch_dicts(query, (schema, table))
         except:
             return []
 
+    def get_all_columns(self) -> Dict[Tuple[str, str], List[Dict[str, Any]]]:
+        """Colunas de todas as tabelas numa única consulta, agrupadas por (schema, tabela)"""
+        query = """
+        SELECT
+            TABLE_SCHEMA,
+            TABLE_NAME,
+            COLUMN_NAME,
+            DATA_TYPE,
+            CHARACTER_MAXIMUM_LENGTH,
+            IS_NULLABLE,
+            COLUMN_DEFAULT
+        FROM INFORMATION_SCHEMA.COLUMNS
+        ORDER BY TABLE_SCHEMA, TABLE_NAME, ORDINAL_POSITION
+        """
+        columns: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+        for record in self._fetch_dicts(query):
+            key = (record.pop('TABLE_SCHEMA'), record.pop('TABLE_NAME'))
+            columns.setdefault(key, []).append(record)
+        return columns
+
+    def get_all_foreign_keys(self) -> Dict[Tuple[str, str], List[Dict[str, Any]]]:
+        """Foreign keys de todas as tabelas numa única consulta, agrupadas por (schema, tabela)"""
+        query = """
+        SELECT
+            OBJECT_SCHEMA_NAME(fk.parent_object_id) AS table_schema,
+            fk.name AS constraint_name,
+            OBJECT_NAME(fk.parent_object_id) AS table_name,
+            COL_NAME(fc.parent_object_id, fc.parent_column_id) AS column_name,
+            OBJECT_NAME(fk.referenced_object_id) AS referenced_table,
+            COL_NAME(fc.referenced_object_id, fc.referenced_column_id) AS referenced_column
+        FROM sys.foreign_keys AS fk
+        INNER JOIN sys.foreign_key_columns AS fc
+            ON fk.object_id = fc.constraint_object_id
+        """
+        foreign_keys: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+        for record in self._fetch_dicts(query):
+            key = (record.pop('table_schema'), record['table_name'])
+            foreign_keys.setdefault(key, []).append(record)
+        return foreign_keys
+
+    def get_all_row_counts(self) -> Dict[Tuple[str, str], int]:
+        """
+        Contagem de linhas de todas as tabelas via sys.dm_db_partition_stats
+        (metadado mantido pelo storage engine, sem varrer as tabelas).
+        """
+        query = """
+        SELECT
+            OBJECT_SCHEMA_NAME(object_id) AS table_schema,
+            OBJECT_NAME(object_id) AS table_name,
+            SUM(row_count) AS cnt
+        FROM sys.dm_db_partition_stats
+        WHERE index_id IN (0, 1)
+        GROUP BY object_id
+        """
+        _, rows = self._fetch_rows(query)
+        return {(schema, table): int(cnt) for schema, table, cnt in rows}
+
+    def prefetch_metadata(self):
+        """
+        Carrega colunas, foreign keys e contagens de todas as tabelas em três
+        consultas; analyze_table passa a ler desses dicionários. Se alguma
+        consulta falhar (ex.: sem permissão na DMV), aquele item continua
+        sendo consultado por tabela.
+        """
+        for attr, loader in (
+            ("_columns", self.get_all_columns),
+            ("_foreign_keys", self.get_all_foreign_keys),
+            ("_row_counts", self.get_all_row_counts),
+        ):
+            try:
+                setattr(self, attr, loader())
+            except Exception as e:
+                print(f"⚠️  Metadados em lote indisponíveis ({loader.__name__}): {e}")
+                setattr(self, attr, None)
+
     def analyze_table(self, schema: str, table: str) -> TableInfo:
-        columns = self.get_table_columns(schema, table)
-        row_count = self.get_table_row_count(schema, table)
-        relationships = self.get_foreign_keys(schema, table)
+        key = (schema, table)
+
+        if self._columns is not None:
+            columns = self._columns.get(key, [])
+        else:
+            columns = self.get_table_columns(schema, table)
+
+        if self._row_counts is not None and key in self._row_counts:
+            row_count = self._row_counts[key]
+        else:
+            row_count = self.get_table_row_count(schema, table)
+
+        if self._foreign_keys is not None:
+            relationships = self._foreign_keys.get(key, [])
+        else:
+            relationships = self.get_foreign_keys(schema, table)
 
         return TableInfo(
             name=table,
@@ -115,25 +279,49 @@ class SQLServerAnalyzer:
         results = []
 
         print(f"\n🔍 Descobrindo estrutura do banco...")
+        self.prefetch_metadata()
         print(f"📊 Encontradas {len(tables)} tabelas\n")
         print("─" * 60)
 
-        for idx, (schema, table) in enumerate(tables, 1):
-            print(f"[{idx}/{len(tables)}] 📋 {schema}.{table}", end=" ")
-            info = self.analyze_table(schema, table)
-
-            emoji = "🟢" if info.row_count > 0 else "🔵"
-            rel_emoji = f" 🔗{len(info.relationships)}" if info.relationships else ""
-            print(f"{emoji} {info.row_count:,} linhas | {len(info.columns)} colunas{rel_emoji}")
+        # As consultas por tabela que restarem (fallback do prefetch) são I/O
+        # no ODBC, que libera o GIL: threads sobrepõem os round-trips
+        with ThreadPoolExecutor(max_workers=ANALYZE_WORKERS) as executor:
+            infos = executor.map(lambda st: self.analyze_table(*st), tables)
+            for idx, info in enumerate(infos, 1):
+                print(f"[{idx}/{len(tables)}] 📋 {info.schema}.{info.name}", end=" ")
+                emoji = "🟢" if info.row_count > 0 else "🔵"
+                rel_emoji = f" 🔗{len(info.relationships)}" if info.relationships else ""
+                print(f"{emoji} {info.row_count:,} linhas | {len(info.columns)} colunas{rel_emoji}")
 
-            results.append(info)
+                results.append(info)
 
         print("─" * 60)
         return results
 
     def get_sample_data(self, schema: str, table: str, limit: int = 5) -> pd.DataFrame:
-        query = text(f"SELECT TOP {limit} * FROM [{schema}].[{table}]")
-        return pd.read_sql(query, self.engine)
+        """
+        Amostra de `limit` linhas lida direto do cursor pyodbc e convertida em
+        DataFrame de uma vez. Amostras pequenas saem num único fetchmany;
+        as maiores são lidas em blocos de SAMPLE_FETCH_CHUNK linhas.
+        """
+        limit = int(limit)
+        chunk = max(1, min(limit, SAMPLE_FETCH_CHUNK))
+        conn = self.engine.raw_connection()
+        try:
+            cur = conn.cursor()
+            cur.arraysize = chunk
+            cur.execute(f"SELECT TOP {limit} * FROM [{schema}].[{table}]")
+            cols = [c[0] for c in cur.description]
+            records = []
+            while True:
+                rows = cur.fetchmany(chunk)
+                records.extend(tuple(row) for row in rows)
+                if len(rows) < chunk:
+                    break
+            cur.close()
+        finally:
+            conn.close()
+        return pd.DataFrame.from_records(records, columns=cols)
 
     def close(self):
         if self.engine:
@@ -1,18 +1,191 @@
 import chromadb
 from chromadb.config import Settings
 from sentence_transformers import SentenceTransformer
+from sentence_transformers.util import batch_to_device
+import torch
+import numpy as np
+from tqdm import tqdm
 from typing import List, Dict, Any, Optional
-import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import hashlib
+import os
+import sqlite3
+
+try:
+    from hf_hub_ctranslate2 import CT2SentenceTransformer
+    CT2_AVAILABLE = True
+except ImportError:
+    CT2_AVAILABLE = False
+    CT2SentenceTransformer = None
+
+try:
+    import httpx
+    HTTPX_AVAILABLE = True
+except ImportError:
+    HTTPX_AVAILABLE = False
+    httpx = None
+
+# Requisições simultâneas (e conexões keep-alive) ao servidor de embeddings
+SERVER_CONCURRENCY = 8
+# Timeout (s) de cada requisição ao servidor de embeddings
+SERVER_TIMEOUT = 120.0
+# Formatos de API aceitos: "tei" (POST /embed) e "openai" (POST /embeddings, ex.: Infinity)
+SERVER_APIS = ("tei", "openai")
+
+# Limite de parâmetros por consulta no SQLite (versões antigas: 999)
+_SQLITE_MAX_VARS = 900
+# Máximo de embeddings mantidos no LRU em memória (~150 MB com 384 dimensões)
+MEMORY_CACHE_SIZE = 100_000
+
+
+def _default_device() -> str:
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+
+@functools.lru_cache(maxsize=4)
+def _load_model(
+    model_name: str,
+    device: str,
+    backend: str = "torch",
+    onnx_file: Optional[str] = None
+) -> SentenceTransformer:
+    """
+    Carrega o modelo uma vez por processo para cada (model_name, device, backend).
+
+    - backend="torch": em GPU roda em fp16; os embeddings voltam a fp32
+      antes de ir ao ChromaDB.
+    - backend="onnx": ONNX Runtime (fusão de operadores; requer
+      `optimum[onnxruntime]`). `onnx_file` escolhe um export do repositório
+      do modelo, ex.: "onnx/model_qint8_avx512_vnni.onnx" (INT8 dinâmico).
+    - backend="ct2": CTranslate2 com pesos int8 (requer `hf_hub_ctranslate2`).
+    """
+    if backend == "ct2":
+        if not CT2_AVAILABLE:
+            raise ImportError("backend='ct2' requer o pacote hf_hub_ctranslate2")
+        return CT2SentenceTransformer(model_name, compute_type="int8", device=device)
+
+    if backend == "onnx":
+        model_kwargs = {"file_name": onnx_file} if onnx_file else None
+        return SentenceTransformer(model_name, device=device, backend="onnx", model_kwargs=model_kwargs)
+
+    model = SentenceTransformer(model_name, device=device)
+    if device.startswith("cuda"):
+        model.half()
+    return model
+
+
+def _embedding_key(namespace: str, text: str) -> bytes:
+    """
+    Chave de cache de um texto: blake2b(namespace + texto), 16 bytes. O
+    namespace identifica tudo que altera o vetor (ver ChromaManager.cache_namespace).
+    """
+    h = hashlib.blake2b(digest_size=16)
+    h.update(namespace.encode("utf-8"))
+    h.update(b"\0")
+    h.update(text.encode("utf-8"))
+    return h.digest()
+
+
+class MemoryEmbeddingCache:
+    """
+    LRU em memória na frente do cache SQLite: textos repetidos (ex.: tabelas
+    com as mesmas colunas de auditoria) não chegam nem ao disco nem ao modelo.
+    """
+
+    def __init__(self, maxsize: int = MEMORY_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+
+    def get_many(self, keys: List[bytes]) -> Dict[bytes, np.ndarray]:
+        data = self._data
+        found: Dict[bytes, np.ndarray] = {}
+        for key in keys:
+            vec = data.get(key)
+            if vec is not None:
+                data.move_to_end(key)
+                found[key] = vec
+        return found
+
+    def put_many(self, items: Dict[bytes, np.ndarray]):
+        data = self._data
+        for key, vec in items.items():
+            data[key] = vec
+            data.move_to_end(key)
+        while len(data) > self.maxsize:
+            data.popitem(last=False)
+
+
+class EmbeddingCache:
+    """
+    Cache persistente de embeddings em SQLite, chaveado por
+    blake2b(namespace + texto). Re-execuções da migração só passam pelo
+    modelo os textos que mudaram.
+    """
+
+    def __init__(self, path: str):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key BLOB PRIMARY KEY, vec BLOB NOT NULL)"
+        )
+
+    def get_many(self, keys: List[bytes]) -> Dict[bytes, np.ndarray]:
+        found: Dict[bytes, np.ndarray] = {}
+        unique = list(dict.fromkeys(keys))
+        for start in range(0, len(unique), _SQLITE_MAX_VARS):
+            chunk = unique[start:start + _SQLITE_MAX_VARS]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self.conn.execute(
+                f"SELECT key, vec FROM embeddings WHERE key IN ({placeholders})", chunk
+            )
+            for key, vec in rows:
+                found[key] = np.frombuffer(vec, dtype=np.float32)
+        return found
+
+    def put_many(self, items: Dict[bytes, np.ndarray]):
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vec) VALUES (?, ?)",
+                ((key, vec.astype(np.float32).tobytes()) for key, vec in items.items())
+            )
+
+    def close(self):
+        self.conn.close()
+
 
 class ChromaManager:
-    def __init__(self, persist_directory: str = "./chroma_db", model_name: str = "all-MiniLM-L6-v2"):
+    def __init__(
+        self,
+        persist_directory: str = "./chroma_db",
+        model_name: str = "all-MiniLM-L6-v2",
+        device: Optional[str] = None,
+        use_cache: bool = True,
+        backend: str = "torch",
+        onnx_file: Optional[str] = None,
+        server_url: Optional[str] = None,
+        cache_dir: str = "./.cache",
+        server_api: str = "tei"
+    ):
+        """
+        Se `server_url` for informado, os embeddings vêm de um servidor e
+        nenhum modelo é carregado no processo. `server_api` escolhe o formato:
+        "tei" (Text Embeddings Inference, POST /embed) ou "openai"
+        (API compatível com OpenAI, ex.: Infinity, POST /embeddings).
+        """
+        if server_api not in SERVER_APIS:
+            raise ValueError(f"server_api inválido: {server_api!r} (use {', '.join(SERVER_APIS)})")
         self.persist_directory = persist_directory
         self.model_name = model_name
+        self.device = device or _default_device()
+        self.backend = backend
+        self.onnx_file = onnx_file
+        self.server_url = server_url.rstrip("/") if server_url else None
+        self.server_api = server_api
 
         print(f"🗄️  Inicializando ChromaDB...", end=" ")
         
         # Cria o diretório se não existir
-        import os
         os.makedirs(persist_directory, exist_ok=True)
         
         # Usa PersistentClient que garante persistência
@@ -24,14 +197,38 @@ class ChromaManager:
         )
         print("✅")
 
-        print(f"🧠 Carregando modelo de embeddings '{model_name}'...", end=" ")
-        self.embedding_model = SentenceTransformer(model_name)
-        print("✅")
+        self.http_client = None
+        if server_url:
+            if not HTTPX_AVAILABLE:
+                raise ImportError("server_url requer o pacote httpx")
+            print(f"🌐 Usando servidor de embeddings {server_url}...", end=" ")
+            self.embedding_model = None
+            self.http_client = httpx.Client(
+                base_url=self.server_url,
+                timeout=SERVER_TIMEOUT,
+                limits=httpx.Limits(
+                    max_connections=SERVER_CONCURRENCY,
+                    max_keepalive_connections=SERVER_CONCURRENCY
+                )
+            )
+            print("✅")
+        else:
+            print(f"🧠 Carregando modelo de embeddings '{model_name}' ({backend}, {self.device})...", end=" ")
+            self.embedding_model = _load_model(model_name, self.device, backend, onnx_file)
+            print("✅")
+
+        # Cache fica fora do diretório do Chroma: backups e limpezas do banco não o afetam
+        self.embedding_cache = None
+        if use_cache:
+            os.makedirs(cache_dir, exist_ok=True)
+            self.embedding_cache = EmbeddingCache(os.path.join(cache_dir, "emb_cache.sqlite3"))
+        self.memory_cache = MemoryEmbeddingCache()
 
     def create_collection(self, name: str, metadata: Optional[Dict] = None) -> chromadb.Collection:
         try:
-            # ChromaDB requer pelo menos uma chave de metadata
-            default_metadata = {"created_by": "migration_script"}
+            # ChromaDB requer pelo menos uma chave de metadata. Os embeddings
+            # já saem normalizados do encode, então cosine vira produto interno
+            default_metadata = {"created_by": "migration_script", "hnsw:space": "cosine"}
             if metadata:
                 default_metadata.update(metadata)
 
@@ -41,20 +238,188 @@ class ChromaManager:
             )
             return collection
         except Exception as e:
-            print(f"❌ Erro ao criar collection: {e}")
+            # Chamado durante a barra de progresso da migração: tqdm.write não a quebra
+            tqdm.write(f"❌ Erro ao criar collection '{name}': {e}")
             raise
 
-    def generate_embeddings(self, texts: List[str], batch_size: int = 1) -> List[List[float]]:
+    def set_max_seq_length(self, max_tokens: int):
         """
-        Gera embeddings UM POR VEZ para evitar problemas de memória
+        Limita o número de tokens por texto. O tokenizer do SentenceTransformer
+        já trunca em `max_seq_length`, então batches de textos curtos (ex.:
+        documentos só de schema) deixam de ser preenchidos até 256/512.
+        O modelo é compartilhado (cache de _load_model): o limite vale para
+        todas as instâncias com o mesmo modelo/dispositivo/backend.
+        Com servidor de embeddings o truncamento é configurado no servidor.
         """
-        # CORREÇÃO DRÁSTICA: Sempre processa um texto por vez
-        all_embeddings = []
-        for text in texts:
-            embedding = self.embedding_model.encode([text], convert_to_numpy=True, show_progress_bar=False)
-            all_embeddings.extend(embedding.tolist())
-        
-        return all_embeddings
+        if self.embedding_model is not None:
+            self.embedding_model.max_seq_length = max_tokens
+
+    def cache_namespace(self) -> str:
+        """
+        Identifica a configuração que produz os vetores: modelo, backend,
+        export ONNX, precisão (fp16 em GPU no torch), max_seq_length ou a URL
+        do servidor. Vetores gerados sob outra configuração (ex.: truncados
+        em outro limite) nunca são devolvidos pelos caches. Calculado a cada
+        chamada: o modelo é compartilhado e max_seq_length pode mudar.
+        """
+        if self.server_url:
+            return "\0".join([self.model_name, "server", self.server_url])
+
+        precision = (
+            "fp16" if self.backend == "torch" and self.device.startswith("cuda")
+            else "int8" if self.backend == "ct2"
+            else "fp32"
+        )
+        return "\0".join([
+            self.model_name,
+            self.backend,
+            self.onnx_file or "",
+            precision,
+            str(getattr(self.embedding_model, "max_seq_length", "")),
+        ])
+
+    def generate_embeddings(self, texts: List[str], batch_size: int = 64) -> List[List[float]]:
+        """
+        Gera embeddings em lote. Cada texto é procurado primeiro no LRU em
+        memória e depois no cache persistente; os que faltam (sem repetição)
+        vão numa única chamada a encode.
+        """
+        if not texts:
+            return []
+
+        namespace = self.cache_namespace()
+        keys = [_embedding_key(namespace, t) for t in texts]
+        found = self.memory_cache.get_many(keys)
+
+        if self.embedding_cache is not None and len(found) < len(keys):
+            from_disk = self.embedding_cache.get_many([k for k in keys if k not in found])
+            self.memory_cache.put_many(from_disk)
+            found.update(from_disk)
+
+        missing: Dict[bytes, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+
+        if missing:
+            encoded = self._encode(list(missing.values()), batch_size)
+            fresh = dict(zip(missing.keys(), encoded))
+            if self.embedding_cache is not None:
+                self.embedding_cache.put_many(fresh)
+            self.memory_cache.put_many(fresh)
+            found.update(fresh)
+
+        return [found[key].tolist() for key in keys]
+
+    def _encode(self, texts: List[str], batch_size: int) -> np.ndarray:
+        """
+        Passa os textos pelo modelo (uma chamada a encode, agrupada em
+        batches de `batch_size` no forward pass).
+        """
+        if self.http_client is not None:
+            return self._encode_remote(texts, batch_size)
+
+        if self.backend == "torch" and len(texts) > batch_size:
+            return self._encode_pipelined(texts, batch_size)
+
+        if self.backend == "ct2":
+            # O encoder CTranslate2 devolve arrays numpy diretamente
+            embeddings = self.embedding_model.encode(
+                texts,
+                batch_size=batch_size,
+                convert_to_numpy=True,
+                normalize_embeddings=True,
+                show_progress_bar=False
+            )
+            return np.asarray(embeddings, dtype=np.float32)
+
+        embeddings = self.embedding_model.encode(
+            texts,
+            batch_size=batch_size,
+            convert_to_tensor=True,
+            normalize_embeddings=True,
+            show_progress_bar=False
+        )
+        # Uma única cópia para a CPU, já em fp32 (formato armazenado no ChromaDB)
+        return embeddings.float().cpu().numpy()
+
+    def _encode_pipelined(self, texts: List[str], batch_size: int) -> np.ndarray:
+        """
+        Como _encode, mas tokeniza o batch seguinte numa thread enquanto o
+        modelo processa o atual. O tokenizer rápido (Rust) libera o GIL, então
+        a tokenização sai do caminho crítico do forward pass.
+        """
+        model = self.embedding_model
+        # Como no encode: sem dropout e sem estado de autograd no forward
+        model.eval()
+        # Ordena por tamanho (como o encode) para reduzir padding em cada batch
+        order = sorted(range(len(texts)), key=lambda i: -len(texts[i]))
+        batches = [
+            [texts[i] for i in order[start:start + batch_size]]
+            for start in range(0, len(order), batch_size)
+        ]
+
+        outputs = []
+        with ThreadPoolExecutor(max_workers=1) as tokenizer_pool:
+            pending = tokenizer_pool.submit(model.tokenize, batches[0])
+            for next_batch in batches[1:] + [None]:
+                features = pending.result()
+                if next_batch is not None:
+                    pending = tokenizer_pool.submit(model.tokenize, next_batch)
+
+                features = batch_to_device(features, model.device)
+                with torch.inference_mode():
+                    embeddings = model(features)["sentence_embedding"]
+                    embeddings = torch.nn.functional.normalize(embeddings, p=2, dim=1)
+                    outputs.append(embeddings.float().cpu())
+
+        sorted_embeddings = torch.cat(outputs).numpy()
+        result = np.empty_like(sorted_embeddings)
+        result[order] = sorted_embeddings
+        return result
+
+    def _encode_remote(self, texts: List[str], batch_size: int) -> np.ndarray:
+        """
+        Envia os textos ao servidor em blocos de `batch_size`, até
+        SERVER_CONCURRENCY requisições em paralelo sobre conexões keep-alive.
+        O servidor faz o batching dinâmico por tokens.
+        """
+        chunks = [texts[start:start + batch_size] for start in range(0, len(texts), batch_size)]
+        post = self._post_openai if self.server_api == "openai" else self._post_tei
+
+        with ThreadPoolExecutor(max_workers=min(SERVER_CONCURRENCY, len(chunks))) as pool:
+            results = list(pool.map(post, chunks))
+
+        return np.asarray([vec for result in results for vec in result], dtype=np.float32)
+
+    def _post_tei(self, chunk: List[str]) -> List[List[float]]:
+        """POST /embed no formato do Text Embeddings Inference"""
+        response = self.http_client.post(
+            "/embed",
+            json={"inputs": chunk, "normalize": True, "truncate": True}
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def _post_openai(self, chunk: List[str]) -> np.ndarray:
+        """
+        POST /embeddings no formato OpenAI ({"model", "input"} → data[].embedding).
+        Para servidores em /v1, inclua o prefixo em `server_url`. A API não
+        normaliza os vetores, então a normalização é feita aqui.
+        """
+        response = self.http_client.post(
+            "/embeddings",
+            json={"model": self.model_name, "input": chunk}
+        )
+        response.raise_for_status()
+        data = sorted(response.json()["data"], key=lambda item: item.get("index", 0))
+        embeddings = np.asarray([item["embedding"] for item in data], dtype=np.float32)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings / np.maximum(norms, 1e-12)
+
+    def generate_embedding(self, text: str) -> List[float]:
+        """Embedding de um único texto (atalho para generate_embeddings)"""
+        return self.generate_embeddings([text])[0]
 
     def add_documents(
         self,
@@ -62,30 +427,64 @@ class ChromaManager:
         documents: List[str],
         metadatas: List[Dict[str, Any]],
         ids: Optional[List[str]] = None,
-        batch_size: int = 1
+        batch_size: int = 256,
+        embeddings: Optional[List[List[float]]] = None
     ):
         """
-        Adiciona documentos UM POR VEZ para evitar problemas de memória
+        Adiciona documentos à collection em blocos de `batch_size`: cada bloco
+        é embedado e gravado com um único collection.add, mantendo a memória
+        limitada ao bloco atual. Se `embeddings` vier pronto (ex.: calculado
+        em lote para várias collections), o modelo não é chamado.
         """
         collection = self.create_collection(collection_name)
 
         if ids is None:
-            ids = [str(uuid.uuid4()) for _ in documents]
+            # Um único os.urandom para todos os ids (em vez de um uuid4 por documento)
+            raw = os.urandom(16 * len(documents))
+            ids = [raw[i:i + 16].hex() for i in range(0, len(raw), 16)]
 
-        # CORREÇÃO DRÁSTICA: Sempre processa um documento por vez
-        for doc, meta, doc_id in zip(documents, metadatas, ids):
-            embeddings = self.generate_embeddings([doc])
-            
+        for start in range(0, len(documents), batch_size):
+            end = start + batch_size
+            batch_docs = documents[start:end]
             collection.add(
-                embeddings=embeddings,
-                documents=[doc],
-                metadatas=[meta],
-                ids=[doc_id]
+                embeddings=(
+                    embeddings[start:end] if embeddings is not None
+                    else self.generate_embeddings(batch_docs)
+                ),
+                documents=batch_docs,
+                metadatas=metadatas[start:end],
+                ids=ids[start:end]
             )
-            
-            # Pequena pausa entre documentos
-            import time
-            time.sleep(0.01)
+
+    def existing_ids(self, collection_name: str, ids: List[str]) -> set:
+        """Subconjunto de `ids` já gravado na collection"""
+        if not ids:
+            return set()
+        collection = self.create_collection(collection_name)
+        return set(collection.get(ids=ids, include=[])["ids"])
+
+    def delete_where(
+        self,
+        collection_name: str,
+        where: Dict[str, Any],
+        keep_ids: Optional[List[str]] = None
+    ):
+        """
+        Remove os documentos da collection que casam com o filtro `where`,
+        exceto os de `keep_ids` (ex.: a versão recém-gravada de uma tabela).
+        """
+        collection = self.create_collection(collection_name)
+        if keep_ids is None:
+            collection.delete(where=where)
+            return
+
+        keep = set(keep_ids)
+        stale = [
+            doc_id for doc_id in collection.get(where=where, include=[])["ids"]
+            if doc_id not in keep
+        ]
+        if stale:
+            collection.delete(ids=stale)
 
     def query_similar(
         self,
@@ -95,7 +494,7 @@ class ChromaManager:
     ) -> Dict[str, Any]:
         collection = self.client.get_collection(collection_name)
 
-        query_embedding = self.generate_embeddings([query_text])[0]
+        query_embedding = self.generate_embedding(query_text)
 
         results = collection.query(
             query_embeddings=[query_embedding],
@@ -116,6 +515,42 @@ class ChromaManager:
         except Exception as e:
             return {"error": str(e)}
 
+    def collection_counts(self) -> Dict[str, int]:
+        """
+        Número de documentos de cada collection. Uma consulta agregada
+        (somente leitura) no sqlite de metadados do ChromaDB evita um count()
+        por collection; como esse formato é interno, toda collection da API
+        pública ausente do resultado (ou com 0) é conferida com count().
+        """
+        collections = self.client.list_collections()
+        counts = self._sqlite_collection_counts()
+
+        return {
+            col.name: counts[col.name] if counts.get(col.name) else col.count()
+            for col in collections
+        }
+
+    def _sqlite_collection_counts(self) -> Dict[str, int]:
+        """Contagens lidas direto do chroma.sqlite3 ({} se o formato não bater)"""
+        db_path = os.path.join(self.persist_directory, "chroma.sqlite3")
+        try:
+            conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+            try:
+                rows = conn.execute(
+                    """
+                    SELECT c.name, COUNT(e.id)
+                    FROM collections c
+                    LEFT JOIN segments s ON s.collection = c.id AND s.scope = 'METADATA'
+                    LEFT JOIN embeddings e ON e.segment_id = s.id
+                    GROUP BY c.name
+                    """
+                ).fetchall()
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            return {}
+        return {name: count for name, count in rows}
+
     def list_collections(self) -> List[str]:
         collections = self.client.list_collections()
         return [col.name for col in collections]
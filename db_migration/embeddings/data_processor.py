@@ -1,4 +1,4 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator, Tuple
 import pandas as pd
 import sys
 import os
@@ -24,23 +24,20 @@ class DataProcessor:
 
     @staticmethod
     def _create_schema_document(table_info: TableInfo) -> Dict[str, Any]:
-        columns_desc = []
-        for col in table_info.columns:
-            col_type = col['DATA_TYPE']
-            col_name = col['COLUMN_NAME']
-            nullable = "nullable" if col['IS_NULLABLE'] == 'YES' else "not null"
-            columns_desc.append(f"{col_name} ({col_type}, {nullable})")
-
-        relationships_desc = []
-        for rel in table_info.relationships:
-            relationships_desc.append(
-                f"{rel['column_name']} references {rel['referenced_table']}.{rel['referenced_column']}"
-            )
+        columns_desc = [
+            f"{col['COLUMN_NAME']} ({col['DATA_TYPE']}, {'nullable' if col['IS_NULLABLE'] == 'YES' else 'not null'})"
+            for col in table_info.columns
+        ]
+
+        relationships_desc = [
+            f"{rel['column_name']} references {rel['referenced_table']}.{rel['referenced_column']}"
+            for rel in table_info.relationships
+        ]
 
         document_text = f"""
         Table: {table_info.schema}.{table_info.name}
         Total Rows: {table_info.row_count}
-        Columns: {', '.join([col['COLUMN_NAME'] for col in table_info.columns])}
+        Columns: {', '.join(col['COLUMN_NAME'] for col in table_info.columns)}
 
         Column Details:
         {chr(10).join(columns_desc)}
@@ -61,29 +58,43 @@ class DataProcessor:
 
     @staticmethod
     def _create_row_documents(table_info: TableInfo, sample_data: pd.DataFrame) -> List[Dict[str, Any]]:
-        documents = []
+        return [
+            {"text": text, "metadata": metadata}
+            for text, metadata in DataProcessor._iter_row_documents(table_info, sample_data)
+        ]
 
-        for idx, row in sample_data.iterrows():
-            row_text = f"Table: {table_info.schema}.{table_info.name}\n"
-            row_text += "Data: "
-
-            row_parts = []
-            for col_name, value in row.items():
-                if pd.notna(value):
-                    row_parts.append(f"{col_name}={value}")
-
-            row_text += ", ".join(row_parts)
+    @staticmethod
+    def _iter_row_documents(table_info: TableInfo, sample_data: pd.DataFrame) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        table_name = f"{table_info.schema}.{table_info.name}"
+        header = f"Table: {table_name}\nData: "
+        columns = list(sample_data.columns)
+
+        # itertuples(name=None) devolve tuplas puras (sem montar uma Series por linha);
+        # `value == value` descarta NaN/NaT sem a chamada a pd.notna por célula
+        for idx, *values in sample_data.itertuples(index=True, name=None):
+            text = header + ", ".join(
+                f"{col_name}={value}"
+                for col_name, value in zip(columns, values)
+                if value is not None and value is not pd.NA and value == value
+            )
+            yield text, {
+                "type": "data",
+                "table": table_name,
+                "row_index": int(idx)
+            }
 
-            documents.append({
-                "text": row_text,
-                "metadata": {
-                    "type": "data",
-                    "table": f"{table_info.schema}.{table_info.name}",
-                    "row_index": int(idx)
-                }
-            })
+    @staticmethod
+    def iter_texts_and_metadatas(table_info: TableInfo, sample_data: pd.DataFrame = None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Equivalente a table_to_documents + prepare_for_embedding numa única
+        passada: gera (texto, metadata) sem montar a lista intermediária de
+        documentos.
+        """
+        schema_doc = DataProcessor._create_schema_document(table_info)
+        yield schema_doc["text"], schema_doc["metadata"]
 
-        return documents
+        if sample_data is not None and not sample_data.empty:
+            yield from DataProcessor._iter_row_documents(table_info, sample_data)
 
     @staticmethod
     def prepare_for_embedding(documents: List[Dict[str, Any]]) -> tuple:
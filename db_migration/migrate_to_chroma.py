@@ -1,34 +1,78 @@
 import os
 from dotenv import load_dotenv
 from analyzer.sql_analyzer import SQLServerAnalyzer
+from analyzer.connection import build_connection_string
 from embeddings.chroma_manager import ChromaManager
 from embeddings.data_processor import DataProcessor
 from tqdm import tqdm
-import gc
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import string
+import traceback
 
-def build_connection_string():
-    host = os.getenv('SQL_SERVER_HOST')
-    database = os.getenv('SQL_SERVER_DATABASE')
-    use_windows_auth = os.getenv('SQL_SERVER_USE_WINDOWS_AUTH', 'False').lower() == 'true'
-    trust_cert = os.getenv('SQL_SERVER_TRUST_CERTIFICATE', 'False').lower() == 'true'
-    user = os.getenv('SQL_SERVER_USER')
-    password = os.getenv('SQL_SERVER_PASSWORD')
+# Documentos acumulados (de várias tabelas) antes de cada chamada ao modelo
+EMBED_BATCH_SIZE = int(os.getenv('EMBED_BATCH_SIZE', '256'))
+# Threads buscando metadados e máximo de tabelas analisadas à frente do embedding
+FETCH_WORKERS = 8
+FETCH_QUEUE_SIZE = 32
+# "per_table": uma collection por tabela (formato consumido pelo backend);
+# "per_database": uma única collection por banco, com schema/tabela na metadata
+COLLECTION_LAYOUT = os.getenv('CHROMA_COLLECTION_LAYOUT', 'per_table').lower()
+COLLECTION_LAYOUTS = ('per_table', 'per_database')
 
-    conn_str = f"DRIVER={{ODBC Driver 17 for SQL Server}};SERVER={host};DATABASE={database};"
+# Minúsculas + espaço -> "_" numa única passada (nomes ASCII)
+_COLLECTION_TRANS = str.maketrans({" ": "_", **{c: c.lower() for c in string.ascii_uppercase}})
 
-    if use_windows_auth:
-        conn_str += "Trusted_Connection=yes;"
-    else:
-        conn_str += f"UID={user};PWD={password};"
+# Buffers do micro-batch (um embedding em lote para várias tabelas),
+# reaproveitados entre flushes em vez de recriados a cada tabela
+_TEXT_BUF: list = []
+_META_BUF: list = []
+_ID_BUF: list = []
+_COLLECTION_BUF: list = []
 
-    if trust_cert:
-        conn_str += "TrustServerCertificate=yes;"
+def normalize_collection_name(name: str) -> str:
+    """Nome de collection em minúsculas, com espaços trocados por "_" """
+    if name.isascii():
+        return name.translate(_COLLECTION_TRANS)
+    # Fora do ASCII a tabela não cobre as maiúsculas: usa lower() completo
+    return name.lower().replace(" ", "_")
 
-    return conn_str, host, database
+def iter_analyzed_tables(analyzer, tables):
+    """
+    Gera (schema, tabela, TableInfo ou exceção) na ordem de `tables`.
+
+    As análises rodam em FETCH_WORKERS threads enquanto o chamador gera os
+    embeddings; no máximo FETCH_QUEUE_SIZE ficam prontas/em andamento à
+    frente do consumo (backpressure). As threads compartilham o pool de
+    conexões do engine do analyzer.
+    """
+    def analyze(schema, table):
+        try:
+            return analyzer.analyze_table(schema, table)
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as pool:
+        window = deque()
+        for schema, table in tables:
+            window.append((schema, table, pool.submit(analyze, schema, table)))
+            if len(window) >= FETCH_QUEUE_SIZE:
+                done_schema, done_table, future = window.popleft()
+                yield done_schema, done_table, future.result()
+        while window:
+            done_schema, done_table, future = window.popleft()
+            yield done_schema, done_table, future.result()
 
 def main():
     load_dotenv()
 
+    if COLLECTION_LAYOUT not in COLLECTION_LAYOUTS:
+        raise ValueError(
+            f"CHROMA_COLLECTION_LAYOUT inválido: {COLLECTION_LAYOUT!r} "
+            f"(use {' ou '.join(COLLECTION_LAYOUTS)})"
+        )
+
     print("╔" + "═" * 58 + "╗")
     print("║" + " " * 10 + "🚀 SQL SERVER → CHROMADB MIGRATION" + " " * 14 + "║")
     print("╚" + "═" * 58 + "╝\n")
@@ -36,11 +80,26 @@ def main():
     connection_string, host, database = build_connection_string()
     chroma_dir = os.getenv('CHROMA_PERSIST_DIRECTORY', './chroma_db')
     embedding_model = os.getenv('EMBEDDING_MODEL', 'all-MiniLM-L6-v2')
+    # "onnx" (ONNX Runtime, padrão) ou "torch"
+    embedding_backend = os.getenv('EMBEDDING_BACKEND', 'onnx')
+    # EMBEDDING_QUANT=int8: CTranslate2 int8 (sobrepõe EMBEDDING_BACKEND)
+    if os.getenv('EMBEDDING_QUANT', '').lower() == 'int8':
+        embedding_backend = 'ct2'
+    # Export ONNX alternativo do repositório do modelo (ex.: onnx/model_O4.onnx em GPU)
+    embedding_onnx_file = os.getenv('EMBEDDING_ONNX_FILE') or None
+    # Documentos só de schema raramente passam de 128 tokens
+    embedding_max_tokens = int(os.getenv('EMBEDDING_MAX_TOKENS', '128'))
+    # Servidor de embeddings: dispensa o modelo local
+    embedding_server_url = os.getenv('EMBEDDING_SERVER_URL') or None
+    # "tei" (POST /embed) ou "openai" (POST /embeddings, ex.: Infinity)
+    embedding_server_api = os.getenv('EMBEDDING_SERVER_API', 'tei').lower()
+    # Cache persistente de embeddings, separado dos dados do ChromaDB
+    embedding_cache_dir = os.getenv('EMBEDDING_CACHE_DIR', './.cache')
 
     print(f"📦 Banco de Dados: {database}")
     print(f"🌐 Servidor: {host}")
     print(f"🎯 ChromaDB: {chroma_dir}")
-    print(f"🧠 Modelo Embeddings: {embedding_model}\n")
+    print(f"🧠 Modelo Embeddings: {embedding_model} ({embedding_server_url or embedding_backend})\n")
 
     # Garante que o diretório ChromaDB existe
     print(f"📁 Verificando diretório ChromaDB...", end=" ")
@@ -54,59 +113,148 @@ def main():
         return
 
     print()
-    chroma = ChromaManager(persist_directory=chroma_dir, model_name=embedding_model)
+    chroma = ChromaManager(
+        persist_directory=chroma_dir,
+        model_name=embedding_model,
+        backend=embedding_backend,
+        onnx_file=embedding_onnx_file,
+        server_url=embedding_server_url,
+        cache_dir=embedding_cache_dir,
+        server_api=embedding_server_api
+    )
+    chroma.set_max_seq_length(embedding_max_tokens)
 
     try:
-        tables = analyzer.get_all_tables()
-        print(f"\n📊 Encontradas {len(tables)} tabelas para migrar")
+        # A lista de tabelas é consumida em streaming; o total vem de um COUNT(*)
+        total_tables = analyzer.count_all_tables()
+        # Colunas, FKs e contagens de todas as tabelas em três consultas:
+        # analyze_table passa a ser leitura de dicionário
+        analyzer.prefetch_metadata()
+        print(f"\n📊 Encontradas {total_tables} tabelas para migrar")
         print("─" * 60)
 
         total_docs = 0
         failed_tables = 0
-        
-        for i, (schema, table) in enumerate(tqdm(tables, desc="🔄 Migrando", ncols=60,
-                                   bar_format="{desc} {percentage:3.0f}% |{bar}| {n_fmt}/{total_fmt}"), 1):
+
+        skipped_docs = 0
+
+        # Com layout por banco, todas as tabelas vão para a mesma collection
+        # (um único índice HNSW); filtros via where={"table": f"{schema}.{table}"}
+        # ou where={"schema": schema}
+        shared_collection = normalize_collection_name(database) if COLLECTION_LAYOUT == 'per_database' else None
+
+        def flush():
+            nonlocal total_docs, skipped_docs, failed_tables
+            if not _TEXT_BUF:
+                return
+
+            # (collection, tabela) -> índices dos documentos da tabela no buffer
+            by_table = defaultdict(list)
+            for idx, (collection_name, meta) in enumerate(zip(_COLLECTION_BUF, _META_BUF)):
+                by_table[(collection_name, meta["table"])].append(idx)
+
+            # Tabelas já resolvidas no lote (gravadas ou inalteradas)
+            done = set()
             try:
-                collection_name = f"{database}_{schema}_{table}".lower().replace(" ", "_")
+                # Tabelas cujos ids (hash do conteúdo) já estão todos gravados não mudaram
+                existing = set()
+                by_collection = defaultdict(list)
+                for idx, collection_name in enumerate(_COLLECTION_BUF):
+                    by_collection[collection_name].append(_ID_BUF[idx])
+                for collection_name, ids in by_collection.items():
+                    existing.update(chroma.existing_ids(collection_name, ids))
 
-                table_info = analyzer.analyze_table(schema, table)
+                changed = {
+                    key: idxs for key, idxs in by_table.items()
+                    if not all(_ID_BUF[i] in existing for i in idxs)
+                }
+                done.update(key for key in by_table if key not in changed)
+                skipped_docs += sum(len(by_table[key]) for key in done)
 
-                # CORREÇÃO DRÁSTICA: Processa APENAS o schema (sem dados de exemplo)
-                # Isso evita completamente o problema de memória
-                documents = DataProcessor.table_to_documents(table_info, sample_data=None)
-                texts, metadatas = DataProcessor.prepare_for_embedding(documents)
+                new_idxs = [i for idxs in changed.values() for i in idxs]
+                embeddings = dict(zip(new_idxs, chroma.generate_embeddings([_TEXT_BUF[i] for i in new_idxs])))
 
-                # Processa documento por documento para máxima segurança
-                for doc_text, doc_meta in zip(texts, metadatas):
+                for key, idxs in changed.items():
+                    collection_name, table_name = key
+                    ids = [_ID_BUF[i] for i in idxs]
+                    # Grava a nova versão primeiro: se falhar, a anterior continua intacta
                     chroma.add_documents(
                         collection_name=collection_name,
-                        documents=[doc_text],  # Um documento por vez
-                        metadatas=[doc_meta],
-                        batch_size=1  # Batch de 1 documento
+                        documents=[_TEXT_BUF[i] for i in idxs],
+                        metadatas=[_META_BUF[i] for i in idxs],
+                        ids=ids,
+                        embeddings=[embeddings[i] for i in idxs]
                     )
-                
-                total_docs += len(documents)
-                
-                # Força limpeza de memória a cada 50 tabelas (mais frequente)
-                if i % 50 == 0:
-                    gc.collect()
+                    # Só então remove os documentos da versão anterior da tabela
+                    chroma.delete_where(collection_name, {"table": table_name}, keep_ids=ids)
+                    total_docs += len(idxs)
+                    done.add(key)
+            except Exception:
+                # Falha no lote: contabiliza as tabelas não gravadas, registra e segue
+                failed = [key[1] for key in by_table if key not in done]
+                failed_tables += len(failed)
+                tqdm.write(
+                    f"❌ Erro ao gravar {len(failed)} tabela(s): {', '.join(failed)}\n"
+                    f"{traceback.format_exc()}"
+                )
+            finally:
+                _TEXT_BUF.clear()
+                _META_BUF.clear()
+                _ID_BUF.clear()
+                _COLLECTION_BUF.clear()
+        
+        analyzed = iter_analyzed_tables(analyzer, analyzer.iter_all_tables())
+        for schema, table, table_info in tqdm(analyzed, total=total_tables, desc="🔄 Migrando", ncols=60,
+                                              bar_format="{desc} {percentage:3.0f}% |{bar}| {n_fmt}/{total_fmt}"):
+            try:
+                if isinstance(table_info, Exception):
+                    raise table_info
+
+                collection_name = shared_collection or normalize_collection_name(f"{database}_{schema}_{table}")
+
+                # Processa APENAS o schema (sem dados de exemplo)
+                texts, metadatas = zip(*DataProcessor.iter_texts_and_metadatas(table_info, sample_data=None))
+
+                # Id derivado do conteúdo: re-execuções reconhecem tabelas inalteradas
+                content_hash = hashlib.sha256(
+                    "\0".join([collection_name, *texts]).encode("utf-8")
+                ).hexdigest()
+                for meta in metadatas:
+                    meta["content_hash"] = content_hash
+                    meta["schema"] = schema
+
+                _TEXT_BUF.extend(texts)
+                _META_BUF.extend(metadatas)
+                _ID_BUF.extend(f"{content_hash}_{n}" for n in range(len(texts)))
+                _COLLECTION_BUF.extend([collection_name] * len(texts))
+
+                if len(_TEXT_BUF) >= EMBED_BATCH_SIZE:
+                    flush()
                     
             except Exception as e:
                 failed_tables += 1
-                # Continua processando outras tabelas mesmo se uma falhar
+                # tqdm.write mantém a barra intacta; segue com as outras tabelas
+                tqdm.write(f"❌ Erro ao processar {schema}.{table}: {e}")
                 continue
 
+        flush()
+
         print("─" * 60)
         print(f"\n📊 Resumo da Migração:")
-        collections = chroma.list_collections()
-        for col_name in collections:
-            info = chroma.get_collection_info(col_name)
-            print(f"   ✓ {col_name}: {info['count']} documentos")
+        collections = chroma.collection_counts()
+        # Uma única escrita para o resumo inteiro (sem um print por collection)
+        if collections:
+            tqdm.write("\n".join(
+                f"   ✓ {col_name}: {count} documentos"
+                for col_name, count in collections.items()
+            ))
 
         print(f"\n📈 Total: {len(collections)} collections | {total_docs} documentos")
+        if skipped_docs:
+            print(f"⏭️  Inalterados desde a última migração: {skipped_docs} documentos")
         
         if failed_tables > 0:
-            success_rate = ((len(tables) - failed_tables) / len(tables)) * 100
+            success_rate = ((total_tables - failed_tables) / total_tables) * 100
             print(f"⚠️  Tabelas com erro: {failed_tables} | Taxa de sucesso: {success_rate:.1f}%")
 
         if failed_tables == 0: